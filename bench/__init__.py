@@ -0,0 +1,4 @@
+"""Sync throughput benchmarks against local stand-ins for the Graph, Sheets and Drive APIs.
+
+Run from the repository root with `python -m bench`; bench.fakes can also be started on its own.
+"""
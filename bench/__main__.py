@@ -0,0 +1,4 @@
+from .harness import main
+
+# Scenario processes are spawned and import the harness module by name, not this __main__
+main()
@@ -0,0 +1,318 @@
+import argparse
+import bisect
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Stand-ins for the Graph API (/v20.0/...), Sheets (/v4/spreadsheets/...) and Drive (/drive/v3/files)
+GRAPH_PREFIX = "/v20.0"
+SHEETS_PREFIX = "/v4/spreadsheets"
+DRIVE_PREFIX = "/drive/v3/files"
+HISTORY_SECONDS = 365 * 86400  # Preloaded leads are spread over the year before the server started
+GRAPH_MAX_PAGE_SIZE = 500
+LEAD_QUESTIONS = ["full_name", "email", "phone_number", "budget"]
+
+class FakeState:
+    """Forms, spreadsheets and call counters shared by every request the fake server handles"""
+    def __init__(self, latency=0.0, throttle_rate=0.0, retry_after=1, seed=0):
+        self.lock = threading.Lock()
+        self.latency = latency  # Seconds added to every API call
+        self.throttle_rate = throttle_rate  # Share of API calls answered with a 429
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.forms = {}  # Form id -> lead creation times, oldest first (lead i has id "<form>_<i>")
+        self.spreadsheets = {}  # Spreadsheet id -> {worksheet title: [rows]}
+        self.calls = {}  # Call kind -> count
+        self.rows_appended = 0
+
+    def configure(self, latency=None, throttle_rate=None, retry_after=None):
+        with self.lock:
+            if latency is not None:
+                self.latency = latency
+            if throttle_rate is not None:
+                self.throttle_rate = throttle_rate
+            if retry_after is not None:
+                self.retry_after = retry_after
+
+    def add_leads(self, form_id, count, history=False):
+        """Add count leads to a form, spread over the past year when history is set, created now otherwise
+
+        Lead ids are positions in the form's history, so history can only be added to an empty form.
+        """
+        now = int(time.time())
+        with self.lock:
+            times = self.forms.setdefault(form_id, [])
+            if history:
+                if times:
+                    raise ValueError(f"Form {form_id} already has leads")
+                times.extend(now - HISTORY_SECONDS + i * HISTORY_SECONDS // max(count, 1) for i in range(count))
+            else:
+                times.extend([now] * count)
+
+    def add_spreadsheet(self, spreadsheet_id, titles=("Sheet1",)):
+        with self.lock:
+            self.spreadsheets.setdefault(spreadsheet_id, {title: [] for title in titles})
+
+    def count(self, kind, amount=1):
+        with self.lock:
+            self.calls[kind] = self.calls.get(kind, 0) + amount
+
+    def throttled(self):
+        with self.lock:
+            return self.throttle_rate > 0 and self.random.random() < self.throttle_rate
+
+    def stats(self):
+        with self.lock:
+            return {"calls": dict(self.calls), "http_calls": sum(count for kind, count in self.calls.items() if kind != "graph_batch_items"),
+                    "rows_appended": self.rows_appended}
+
+    def sheet_counts(self):
+        """Data rows (below the header) and distinct data rows of each spreadsheet's first tab"""
+        with self.lock:
+            counts = {}
+            for spreadsheet_id, worksheets in self.spreadsheets.items():
+                rows = next(iter(worksheets.values()))[1:]
+                counts[spreadsheet_id] = {"rows": len(rows), "distinct": len({tuple(row) for row in rows})}
+            return counts
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls = {}
+            self.rows_appended = 0
+
+    def lead(self, form_id, index, created):
+        return {"id": f"{form_id}_{index}", "form_id": form_id, "created_time": time.strftime("%Y-%m-%dT%H:%M:%S+0000", time.gmtime(created)),
+                "field_data": [{"name": question, "values": [f"{question} {index}"]} for question in LEAD_QUESTIONS]}
+
+    def leads_page(self, base_url, form_id, params):
+        """One page of a form's leads, newest first, filtered on time_created like the real edge"""
+        with self.lock:
+            times = self.forms.get(form_id, [])
+            low, high = 0, len(times)
+            for condition in json.loads(params.get("filtering", "[]")):
+                if condition.get("field") != "time_created":
+                    continue
+                if condition["operator"] == "GREATER_THAN":
+                    low = max(low, bisect.bisect_right(times, int(condition["value"])))
+                elif condition["operator"] == "LESS_THAN":
+                    high = min(high, bisect.bisect_left(times, int(condition["value"])))
+            limit = min(int(params.get("limit", 25)), GRAPH_MAX_PAGE_SIZE)
+            offset = int(params.get("after", 0))
+            newest = high - 1 - offset
+            indexes = range(newest, max(newest - limit, low - 1), -1)
+            page = {"data": [self.lead(form_id, i, times[i]) for i in indexes], "paging": {}}
+        if newest - limit >= low:
+            next_params = dict(params, after=str(offset + limit))
+            page["paging"]["next"] = f"{base_url}{GRAPH_PREFIX}/{form_id}/leads?{urllib.parse.urlencode(next_params)}"
+        return page
+
+    def graph_get(self, base_url, relative_url):
+        """Answer a relative Graph URL; returns (status, body)"""
+        parts = urllib.parse.urlsplit(relative_url)
+        params = dict(urllib.parse.parse_qsl(parts.query))
+        params.pop("access_token", None)
+        path = parts.path.strip("/").split("/")
+        if len(path) == 2 and path[1] == "leads":
+            return 200, self.leads_page(base_url, path[0], params)
+        if path == [""] and "ids" in params:
+            leads = {}
+            for lead_id in params["ids"].split(","):
+                form_id, _, index = lead_id.rpartition("_")
+                with self.lock:
+                    times = self.forms.get(form_id, [])
+                    if index.isdigit() and int(index) < len(times):
+                        leads[lead_id] = self.lead(form_id, int(index), times[int(index)])
+            return 200, leads
+        if len(path) == 1 and path[0] in self.forms:
+            with self.lock:
+                created = self.forms[path[0]][0] if self.forms[path[0]] else int(time.time())
+            return 200, {"id": path[0], "created_time": time.strftime("%Y-%m-%dT%H:%M:%S+0000", time.gmtime(created))}
+        return 404, {"error": {"message": f"Unknown path {parts.path}", "type": "GraphMethodException", "code": 100}}
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real APIs, so connection pooling is measured too
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def base_url(self):
+        return f"http://{self.headers.get('Host')}"
+
+    def send_json(self, status, body, headers=()):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def do_PUT(self):
+        self.route("PUT")
+
+    def route(self, method):
+        body = self.read_body()
+        path = urllib.parse.urlsplit(self.path).path
+        if path.startswith("/_bench/"):
+            return self.control(path[len("/_bench/"):], json.loads(body or b"{}"))
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        if path.startswith(GRAPH_PREFIX):
+            self.graph(method, body)
+        elif path.startswith(SHEETS_PREFIX):
+            self.sheets(method, body)
+        elif path.startswith(DRIVE_PREFIX):
+            self.state.count("drive")
+            with self.state.lock:
+                files = [{"id": spreadsheet_id, "name": spreadsheet_id} for spreadsheet_id in self.state.spreadsheets]
+            self.send_json(200, {"files": files})
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {path}"}})
+
+    def control(self, command, params):
+        if command == "forms":
+            for form_id, count in params.get("leads", {}).items():
+                self.state.add_leads(form_id, count, params.get("history", False))
+            for spreadsheet_id in params.get("spreadsheets", []):
+                self.state.add_spreadsheet(spreadsheet_id)
+            self.send_json(200, {})
+        elif command == "configure":
+            self.state.configure(**params)
+            self.send_json(200, {})
+        elif command == "stats":
+            self.send_json(200, self.state.stats())
+        elif command == "sheets":
+            self.send_json(200, self.state.sheet_counts())
+        elif command == "reset":
+            self.state.reset_counters()
+            self.send_json(200, {})
+        else:
+            self.send_json(404, {})
+
+    def graph(self, method, body):
+        if self.state.throttled():
+            # The client reads the error code, as the real API signals its limits in the body
+            self.state.count("throttled")
+            return self.send_json(429, {"error": {"message": "Application request limit reached", "type": "OAuthException", "code": 4}})
+        if method == "POST":
+            form = dict(urllib.parse.parse_qsl(body.decode()))
+            batch = json.loads(form.get("batch", "[]"))
+            self.state.count("graph_batch")
+            self.state.count("graph_batch_items", len(batch))
+            responses = []
+            for request in batch:
+                status, response = self.state.graph_get(self.base_url(), request["relative_url"])
+                responses.append({"code": status, "headers": [{"name": "Content-Type", "value": "application/json"}], "body": json.dumps(response)})
+            return self.send_json(200, responses)
+        self.state.count("graph_get")
+        status, response = self.state.graph_get(self.base_url(), self.path[len(GRAPH_PREFIX):])
+        self.send_json(status, response)
+
+    def sheets(self, method, body):
+        if self.state.throttled():
+            self.state.count("throttled")
+            return self.send_json(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}},
+                                  [("Retry-After", str(self.state.retry_after))])
+        rest = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path[len(SHEETS_PREFIX) + 1:])
+        spreadsheet_id, _, rest = rest.partition("/")
+        spreadsheet_id, _, action = spreadsheet_id.partition(":")
+        with self.state.lock:
+            worksheets = self.state.spreadsheets.get(spreadsheet_id)
+        if worksheets is None:
+            return self.send_json(404, {"error": {"code": 404, "status": "NOT_FOUND"}})
+
+        if method == "GET" and not rest:
+            self.state.count("sheets_metadata")
+            return self.send_json(200, {"sheets": [{"properties": {"sheetId": i, "title": title}} for i, title in enumerate(worksheets)]})
+        if action == "batchUpdate":
+            self.state.count("sheets_batch_update")
+            titles = list(worksheets)
+            appended = 0
+            with self.state.lock:
+                for request in json.loads(body)["requests"]:
+                    cells = request["appendCells"]
+                    rows = [[value.get("userEnteredValue", {}).get("stringValue", "") for value in row["values"]] for row in cells["rows"]]
+                    worksheets[titles[cells["sheetId"]]].extend(rows)
+                    appended += len(rows)
+                self.state.rows_appended += appended
+            return self.send_json(200, {"spreadsheetId": spreadsheet_id, "replies": [{}] * appended})
+
+        # values/'Title'!Range[:append]
+        cell_range, _, values_action = rest[len("values/"):].partition(":")
+        title, _, cell_range = cell_range.rpartition("!")
+        title = title.strip("'")
+        if title not in worksheets:
+            return self.send_json(400, {"error": {"code": 400, "message": f"Unable to parse range: {title}"}})
+        rows = worksheets[title]
+        if values_action == "append":
+            self.state.count("sheets_append")
+            appended = json.loads(body)["values"]
+            with self.state.lock:
+                rows.extend(appended)
+                self.state.rows_appended += len(appended)
+            return self.send_json(200, {"updates": {"updatedRows": len(appended)}})
+        if method == "PUT":
+            # Only whole rows starting at column A are written (the header row)
+            self.state.count("sheets_update")
+            row = int(cell_range.lstrip("A")) - 1
+            with self.state.lock:
+                while len(rows) <= row:
+                    rows.append([])
+                rows[row] = json.loads(body)["values"][0]
+            return self.send_json(200, {"updatedRows": 1})
+
+        self.state.count("sheets_get")
+        start, _, end = cell_range.partition(":")
+        with self.state.lock:
+            if start.isdigit():
+                index = int(start) - 1
+                values = [rows[index]] if index < len(rows) and rows[index] else []
+            else:
+                column = ord(start) - ord("A")
+                values = [[row[column] if column < len(row) else "" for row in rows]] if rows else []
+        self.send_json(200, {"range": f"'{title}'!{cell_range}", "values": values})
+
+def start_fake_server(port=0, host="127.0.0.1", **options):
+    """Serve the fake APIs from a background thread; the port is chosen when 0"""
+    server = ThreadingHTTPServer((host, port), FakeHandler)
+    server.daemon_threads = True
+    server.state = FakeState(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve fake Graph, Sheets and Drive APIs for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0, help="delay added to every API call")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="share of API calls answered with a 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with Sheets 429s")
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), FakeHandler)
+    server.daemon_threads = True
+    server.state = FakeState(args.latency_ms / 1000, args.throttle_rate, args.retry_after)
+    print(f"Serving fake APIs on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import time
+import urllib.request
+
+from .fakes import GRAPH_PREFIX, SHEETS_PREFIX, start_fake_server
+
+# Each scenario runs in a fresh process against a fresh fake server, so peak RSS is its own
+SCENARIOS = {
+    "one_form_100k": {"description": "1 form x 100k leads, first sync to an empty sheet",
+                      "syncs": 1, "leads": 100000, "new_leads": 0, "rounds": 1, "warmup": False},
+    "500_syncs_10_new": {"description": "500 syncs x 10 new leads per cycle",
+                         "syncs": 500, "leads": 20, "new_leads": 10, "rounds": 3, "warmup": True},
+    "steady_state": {"description": "500 syncs, no new leads",
+                     "syncs": 500, "leads": 20, "new_leads": 0, "rounds": 3, "warmup": True},
+}
+UNTHROTTLED_RATE = 1e9  # Token bucket rate and burst used unless --real-limits is given
+REGRESSION_TOLERANCE = 0.25  # Allowed change against a baseline before --compare fails
+CATCH_UP_ROUNDS = 10  # Extra unmeasured rounds allowed, with 429s on, to retry leads whose cycle failed
+
+class CycleLog(logging.Handler):
+    """Collects the JSON line the engine logs for every finished cycle"""
+    def __init__(self):
+        super().__init__()
+        self.cycles = []
+
+    def emit(self, record):
+        self.cycles.append(json.loads(record.getMessage()))
+
+def control(base_url, command, params=None):
+    request = urllib.request.Request(f"{base_url}/_bench/{command}", data=json.dumps(params or {}).encode(), method="POST")
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def peak_rss_mb():
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def run_scenario(base_url, scenario, options, results):
+    """Drive the real sync engine through one scenario (runs in its own process)"""
+    from leadeable import engine, throttle
+    engine.GRAPH_API_URL = base_url + GRAPH_PREFIX
+    engine.SHEETS_API_URL = base_url + SHEETS_PREFIX
+    if not options["real_limits"]:
+        throttle.GRAPH_CALLS_PER_SECOND = throttle.GRAPH_BURST = UNTHROTTLED_RATE
+        throttle.SHEETS_REQUESTS_PER_SECOND = throttle.SHEETS_BURST = UNTHROTTLED_RATE
+    # Throttled tokens stay blocked for one Retry-After, not Graph's real cooldown
+    throttle.GRAPH_USAGE_COOLDOWN_SECONDS = options["retry_after"]
+
+    cycle_log = CycleLog()
+    cycle_logger = logging.getLogger("leadeable.cycles")
+    cycle_logger.addHandler(cycle_log)
+    cycle_logger.setLevel(logging.INFO)
+    cycle_logger.propagate = False
+
+    syncs = [engine.SyncConfig(f"bench_{i}", f"fb-token-{i % options['tokens']}", "act_bench", f"form-{i}",
+                               f"sheet-{i}", 60, "google-token") for i in range(scenario["syncs"])]
+    control(base_url, "forms", {"leads": {sync.form_id: scenario["leads"] for sync in syncs}, "history": True,
+                                "spreadsheets": [sync.sheet_id for sync in syncs]})
+
+    with tempfile.TemporaryDirectory() as directory:
+        sync_engine = engine.SyncEngine(on_status=lambda message: None, max_concurrency=options["concurrency"],
+                                        ledger=engine.LeadLedger(os.path.join(directory, "bench.db")))
+
+        async def run_round():
+            # Cycles are started directly rather than through the scheduler, so every sync runs once per round
+            await asyncio.gather(*(sync_engine.run_sync_cycle(sync) for sync in syncs))
+
+        def cycle_round():
+            asyncio.run_coroutine_threadsafe(run_round(), sync_engine.loop).result()
+
+        if scenario["warmup"]:
+            cycle_round()
+        cycle_log.cycles = []
+        control(base_url, "reset")
+        deferred = sync_engine.limiter.stats()["deferred"]
+        elapsed = 0
+        for _ in range(scenario["rounds"]):
+            if scenario["new_leads"]:
+                control(base_url, "forms", {"leads": {sync.form_id: scenario["new_leads"] for sync in syncs}})
+            start = time.perf_counter()
+            cycle_round()
+            elapsed += time.perf_counter() - start
+        deferred = sync_engine.limiter.stats()["deferred"] - deferred
+
+        # Every lead has to end up in its sheet exactly once; a lost lead must not pass for a speed-up.
+        # Failed or deferred cycles are only expected with 429s on, so only then are they retried first.
+        expected = scenario["leads"] + scenario["new_leads"] * scenario["rounds"]
+        calls = control(base_url, "stats")
+        cycles = list(cycle_log.cycles)
+        problems = lead_problems(base_url, syncs, expected)
+        if options["throttle_rate"]:
+            for _ in range(CATCH_UP_ROUNDS):
+                if not problems:
+                    break
+                time.sleep(options["retry_after"])
+                cycle_round()
+                problems = lead_problems(base_url, syncs, expected)
+        sync_engine.shutdown()
+
+    durations = [cycle["seconds"] for cycle in cycles]
+    written = sum(cycle["counts"].get("rows_written", 0) for cycle in cycles)
+    results.put({
+        "scenario": scenario["name"],
+        "cycles": len(cycles),
+        "errors": sum(1 for cycle in cycles if cycle["result"] != "ok"),
+        "deferred": deferred,
+        "leads_written": written,
+        "seconds": round(elapsed, 3),
+        "leads_per_second": round(written / elapsed, 1) if elapsed else 0,
+        "http_calls": calls["http_calls"],
+        "http_calls_per_cycle": round(calls["http_calls"] / max(len(cycles), 1), 2),
+        "calls": calls["calls"],
+        "cycle_p50_seconds": round(percentile(durations, 0.5), 3),
+        "cycle_p99_seconds": round(percentile(durations, 0.99), 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "lead_problems": problems,
+    })
+
+def lead_problems(base_url, syncs, expected):
+    """Sheets that do not hold each of their form's leads exactly once"""
+    counts = control(base_url, "sheets")
+    problems = []
+    for sync in syncs:
+        rows, distinct = counts[sync.sheet_id]["rows"], counts[sync.sheet_id]["distinct"]
+        if rows != expected or distinct != rows:
+            problems.append(f"{sync.sheet_id}: {rows} rows, {distinct} distinct, expected {expected}")
+    return problems
+
+def run(name, args):
+    scenario = dict(SCENARIOS[name], name=name)
+    for key in ("syncs", "leads", "new_leads", "rounds"):
+        if getattr(args, key) is not None:
+            scenario[key] = getattr(args, key)
+    print(f"Running {name}: {scenario['description']} ({scenario['syncs']} syncs, {scenario['leads']} leads per form, "
+          f"{scenario['new_leads']} new per round, {scenario['rounds']} rounds)", flush=True)
+    options = {"real_limits": args.real_limits, "retry_after": args.retry_after, "tokens": args.tokens,
+               "concurrency": args.concurrency, "throttle_rate": args.throttle_rate}
+
+    server = start_fake_server(latency=args.latency_ms / 1000, throttle_rate=args.throttle_rate, retry_after=args.retry_after)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=run_scenario, args=(base_url, scenario, options, results))
+    process.start()
+    try:
+        while True:
+            try:
+                result = results.get(timeout=1)
+                break
+            except queue.Empty:
+                if not process.is_alive():
+                    raise RuntimeError(f"Scenario {name} exited without results (exit code {process.exitcode})")
+    finally:
+        process.join()
+        server.shutdown()
+        server.server_close()
+    return result
+
+def regressions(result, baseline, tolerance):
+    """Metrics of result that are worse than baseline by more than tolerance"""
+    found = []
+    if result["leads_per_second"] < baseline["leads_per_second"] * (1 - tolerance):
+        found.append(f"leads/s {baseline['leads_per_second']} -> {result['leads_per_second']}")
+    for key in ("http_calls_per_cycle", "cycle_p50_seconds", "cycle_p99_seconds", "peak_rss_mb"):
+        if result[key] > baseline[key] * (1 + tolerance) and result[key] - baseline[key] > 0.01:
+            found.append(f"{key} {baseline[key]} -> {result[key]}")
+    return found
+
+def print_result(result):
+    print(f"{result['scenario']}: {result['leads_written']} leads in {result['seconds']}s "
+          f"({result['leads_per_second']} leads/s), {result['cycles']} cycles, {result['errors']} errors, "
+          f"{result['deferred']} deferred")
+    print(f"  HTTP calls: {result['http_calls']} ({result['http_calls_per_cycle']} per cycle) {result['calls']}")
+    print(f"  cycle latency p50 {result['cycle_p50_seconds']}s, p99 {result['cycle_p99_seconds']}s, "
+          f"peak RSS {result['peak_rss_mb']} MB", flush=True)
+    if result["lead_problems"]:
+        print(f"  LEADS NOT WRITTEN EXACTLY ONCE in {len(result['lead_problems'])} sheets, e.g. {result['lead_problems'][0]}", flush=True)
+    else:
+        print("  every lead written exactly once", flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench", description="Benchmark the sync engine against fake Graph and Sheets APIs")
+    parser.add_argument("scenarios", nargs="*", metavar="scenario", help=f"scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument("--syncs", type=int, help="override the number of syncs")
+    parser.add_argument("--leads", type=int, help="override the leads each form starts with")
+    parser.add_argument("--new-leads", type=int, help="override the leads added to each form before every round")
+    parser.add_argument("--rounds", type=int, help="override the measured rounds of cycles")
+    parser.add_argument("--tokens", type=int, default=1, help="Facebook access tokens shared out across the syncs")
+    parser.add_argument("--concurrency", type=int, default=8, help="the engine's max_concurrency")
+    parser.add_argument("--latency-ms", type=float, default=0, help="delay the fake APIs add to every call")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="share of API calls answered with a 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="seconds a throttled token or spreadsheet is blocked")
+    parser.add_argument("--real-limits", action="store_true", help="keep the client-side rate limits instead of lifting them")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="fail if results are worse than in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE, help="allowed change against --compare")
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario {', '.join(unknown)}")
+
+    results = []
+    for name in args.scenarios or SCENARIOS:
+        results.append(run(name, args))
+        print_result(results[-1])
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    failed = any(result["lead_problems"] for result in results)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {result["scenario"]: result for result in json.load(f)}
+        for result in results:
+            if result["scenario"] in baseline:
+                for regression in regressions(result, baseline[result["scenario"]], args.tolerance):
+                    print(f"Regression in {result['scenario']}: {regression}")
+                    failed = True
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,8 @@
+"""Sync Facebook lead form leads into Google Sheets.
+
+The sync engine is importable without Tk; the GUI lives in leadeable.gui and is only
+loaded when it is started.
+"""
+from .engine import LeadLedger, SheetsWorksheet, SyncConfig, SyncEngine
+
+__all__ = ["LeadLedger", "SheetsWorksheet", "SyncConfig", "SyncEngine"]
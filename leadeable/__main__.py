@@ -0,0 +1,122 @@
+import argparse
+import json
+import logging
+import signal
+import threading
+from datetime import datetime, timezone
+
+from .engine import SyncConfig, SyncEngine, LeadLedger, LEDGER_PATH, MAX_CONCURRENT_SYNCS, WEBHOOK_HOST, WEBHOOK_PORT, FACEBOOK_APP_SECRET, METRICS_PORT
+
+logger = logging.getLogger("leadeable")
+
+# Keys every sync needs, either on the sync itself or as a top-level default
+SYNC_FIELDS = ["fb_access_token", "ad_account_id", "form_id", "sheet_id", "frequency_minutes", "google_token"]
+
+def load_config(path):
+    """Read a YAML (or JSON) config with top-level defaults and a list of syncs"""
+    with open(path) as f:
+        if path.endswith(".json"):
+            config = json.load(f)
+        else:
+            try:
+                import yaml
+            except ImportError:
+                raise SystemExit("Reading YAML configs needs PyYAML (pip install pyyaml), or use a .json config")
+            config = yaml.safe_load(f)
+
+    syncs = []
+    for i, entry in enumerate(config.get("syncs", [])):
+        values = {key: entry.get(key, config.get(key)) for key in SYNC_FIELDS}
+        missing = [key for key, value in values.items() if value is None]
+        if missing:
+            raise SystemExit(f"Sync {i + 1} in {path} is missing: {', '.join(missing)}")
+        values["form_id"] = str(values["form_id"])
+        try:
+            values["frequency_minutes"] = int(values["frequency_minutes"])
+        except (TypeError, ValueError):
+            raise SystemExit(f"Sync {i + 1} in {path} has a non-integer frequency_minutes: {values['frequency_minutes']!r}")
+        if values["frequency_minutes"] < 1:
+            raise SystemExit(f"Sync {i + 1} in {path} needs a frequency_minutes of at least 1")
+        syncs.append(SyncConfig(entry.get("name", f"Sync_{i + 1}"), worksheet=entry.get("worksheet"), **values))
+    return config, syncs
+
+def create_engine(config):
+    return SyncEngine(max_concurrency=config.get("max_concurrency", MAX_CONCURRENT_SYNCS),
+                      ledger=LeadLedger(config.get("ledger", LEDGER_PATH)))
+
+def run(args):
+    """Run every configured sync headlessly until SIGINT/SIGTERM"""
+    config, syncs = load_config(args.config)
+    engine = create_engine(config)
+    webhook = config.get("webhook")
+    if webhook:
+        try:
+            engine.start_webhook(port=webhook.get("port", WEBHOOK_PORT), verify_token=webhook["verify_token"],
+                                 app_secret=webhook.get("app_secret", FACEBOOK_APP_SECRET), host=webhook.get("host", WEBHOOK_HOST))
+        except ValueError as e:
+            engine.shutdown()
+            raise SystemExit(str(e))
+    metrics = config.get("metrics")
+    if metrics:
+        engine.start_metrics(port=metrics.get("port", METRICS_PORT), host=metrics.get("host", "127.0.0.1"))
+    for sync in syncs:
+        engine.submit(sync)
+    logger.info(f"Running {len(syncs)} syncs")
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    try:
+        while not stopping.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    logger.info("Stopping")
+    engine.shutdown()
+
+def backfill(args):
+    """Write the forms' history to the configured sheets; rerunning after an interruption resumes it"""
+    config, syncs = load_config(args.config)
+    if args.sync:
+        syncs = [sync for sync in syncs if sync.name in args.sync]
+        if not syncs:
+            raise SystemExit(f"No syncs named {', '.join(args.sync)} in {args.config}")
+    since = None
+    if args.since:
+        since = int(datetime.strptime(args.since, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp())
+
+    engine = create_engine(config)
+    try:
+        for sync in syncs:
+            engine.start_backfill(sync, since).result()
+    except KeyboardInterrupt:
+        logger.info("Backfill interrupted, run the same command again to resume")
+    finally:
+        engine.shutdown()
+
+def gui(args):
+    # Tk and PIL are only imported here, so headless runs never load them
+    from .gui import main
+    main()
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(prog="leadeable", description="Sync Facebook leads with Google Sheets")
+    commands = parser.add_subparsers(dest="command")
+    run_parser = commands.add_parser("run", help="run syncs headlessly from a config file")
+    run_parser.add_argument("--config", required=True, help="YAML or JSON file listing the syncs")
+    run_parser.set_defaults(func=run)
+    backfill_parser = commands.add_parser("backfill", help="write each form's existing leads to its sheet")
+    backfill_parser.add_argument("--config", required=True, help="YAML or JSON file listing the syncs")
+    backfill_parser.add_argument("--sync", action="append", help="only backfill the sync with this name (repeatable)")
+    backfill_parser.add_argument("--since", help="start at this date (YYYY-MM-DD) instead of the form's creation")
+    backfill_parser.set_defaults(func=backfill)
+    commands.add_parser("gui", help="open the desktop app (default)").set_defaults(func=gui)
+
+    args = parser.parse_args()
+    if args.command:
+        args.func(args)
+    else:
+        gui(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1162 @@
+import requests
+import time
+from datetime import datetime
+import threading
+import asyncio
+import heapq
+import itertools
+import random
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import urllib.parse
+import json
+import sqlite3
+import hmac
+import hashlib
+import ipaddress
+import logging
+
+from .metrics import CycleStats, Metrics, start_metrics_server
+from .throttle import RateLimiter
+
+logger = logging.getLogger(__name__)
+cycle_logger = logging.getLogger("leadeable.cycles")  # One JSON line per finished sync cycle
+
+# Facebook Graph API settings
+GRAPH_API_URL = "https://graph.facebook.com/v20.0"
+GRAPH_PAGE_SIZE = 100  # Leads per page when following the paging cursor
+GRAPH_BATCH_SIZE = 50  # Graph's limit on requests per batch call
+GRAPH_BATCH_WINDOW_SECONDS = 1.0  # How long a due fetch waits for others sharing its access token
+GRAPH_STREAM_BUFFER_PAGES = 2  # Pages fetched ahead of a sync's sheet writes before paging waits for them
+
+# Leadgen webhook settings (real-time mode; polling then only reconciles)
+WEBHOOK_ENABLED = False
+WEBHOOK_HOST = "127.0.0.1"  # Serving on any other address needs FACEBOOK_APP_SECRET, so notifications can be verified
+WEBHOOK_PORT = 8001
+WEBHOOK_VERIFY_TOKEN = "YOUR WEBHOOK VERIFY TOKEN"
+FACEBOOK_APP_SECRET = ""  # Enables X-Hub-Signature-256 checks on notifications when set
+WEBHOOK_BATCH_WINDOW_SECONDS = 2.0  # Notifications for a form arriving within this window are fetched together
+WEBHOOK_RECONCILE_MINUTES = 360  # Minimum polling interval while the webhook is receiving leads
+
+# Google Sheets settings
+SHEETS_API_URL = "https://sheets.googleapis.com/v4/spreadsheets"
+SHEET_HEADERS = ["Date", "Name", "Email"]  # Every other form question gets a column named after its field
+HEADER_FIELDS = {"Date": "created_time", "Name": "full_name", "Email": "email"}
+SHEETS_APPEND_CHUNK_SIZE = 500  # Rows per append request, keeps payloads within request-size limits
+SHEETS_COALESCE_WINDOW_SECONDS = 0.5  # Appends to one spreadsheet within this window share a request
+SHEETS_BATCH_MAX_ROWS = 5000  # Rows per coalesced request before it is split; a spreadsheet with this many queued is flushed at once
+SHEETS_STREAM_QUEUED_ROWS = 2 * SHEETS_BATCH_MAX_ROWS  # Rows a polling sync keeps queued on the writer while paging carries on
+SHEETS_FLUSH_WORKERS = 4  # Spreadsheets flushed at the same time
+
+# Sync engine settings
+MAX_CONCURRENT_SYNCS = 8  # Blocking Graph/Sheets calls (and pooled HTTP connections) allowed at the same time
+ERROR_RETRY_BASE_SECONDS = 30  # First retry delay after a failed cycle, doubled on each further failure
+ERROR_RETRY_MAX_SECONDS = 3600
+SCHEDULE_JITTER_FRACTION = 0.1  # Each deadline moves randomly by up to this share of the interval, either way
+SCHEDULE_JITTER_MAX_SECONDS = 120
+SCHEDULE_START_SPREAD_SECONDS = 900  # First cycles of syncs started together are spread over this long (or their interval)
+
+# Historical backfill settings
+BACKFILL_WINDOW_DAYS = 7  # Span of lead creation time fetched as one unit of work
+BACKFILL_WORKERS = 4  # Windows fetched at the same time (and held ahead of the ordered writer)
+BACKFILL_APPEND_CHUNK_SIZE = 2000  # Rows per append request while backfilling
+
+# Local lead ledger (SQLite file next to the app)
+LEDGER_PATH = "leadeable.db"
+
+# Metrics settings (Prometheus text format at http://127.0.0.1:9464/metrics)
+METRICS_ENABLED = False
+METRICS_PORT = 9464
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def graph_time(value):
+    """Convert a Graph timestamp such as 2024-05-01T12:34:56+0000 to Unix time"""
+    return int(datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z").timestamp())
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        # Subscription verification: echo the challenge back if the verify token matches
+        params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        if params.get("hub.mode") == ["subscribe"] and params.get("hub.verify_token") == [self.server.context["verify_token"]]:
+            self.send_response(200)
+            self.send_header("Content-type", "text/plain")
+            self.end_headers()
+            self.wfile.write(params.get("hub.challenge", [""])[0].encode())
+        else:
+            self.send_error(403)
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            self.send_error(400)
+            return
+        body = self.rfile.read(length)
+        app_secret = self.server.context.get("app_secret")
+        if app_secret:
+            expected = "sha256=" + hmac.new(app_secret.encode(), body, hashlib.sha256).hexdigest()
+            if not hmac.compare_digest(expected, self.headers.get("X-Hub-Signature-256", "")):
+                self.send_error(403)
+                return
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            self.send_error(400)
+            return
+        self.send_response(200)
+        self.end_headers()
+
+        lead_ids = {}  # Form id -> notified lead ids
+        for entry in payload.get("entry", []):
+            for change in entry.get("changes", []) if isinstance(entry, dict) else []:
+                value = change.get("value") if isinstance(change, dict) else None
+                if isinstance(value, dict) and change.get("field") == "leadgen" and "leadgen_id" in value:
+                    lead_ids.setdefault(str(value.get("form_id")), []).append(str(value["leadgen_id"]))
+        for form_id, ids in lead_ids.items():
+            self.server.context["engine"].notify_leads(form_id, ids)
+
+class SyncConfig:
+    def __init__(self, name, fb_access_token, ad_account_id, form_id, sheet_id, frequency_minutes, google_token, worksheet=None):
+        self.name = name
+        self.fb_access_token = fb_access_token
+        self.ad_account_id = ad_account_id
+        self.form_id = form_id
+        self.sheet_id = sheet_id
+        self.worksheet = worksheet  # Tab to write to; the first one when None
+        self.frequency_minutes = frequency_minutes
+        self.google_token = google_token
+        self.running = False
+        self.task = None  # asyncio task of the cycle currently running on the sync engine's loop
+        self.sheet = None  # Worksheet handle, opened on the first cycle after a start
+        self.generation = 0  # Bumped on every (re)schedule; older scheduler queue entries are ignored
+        self.last_started = None  # Loop time the last cycle started
+        self.failures = 0  # Consecutive failed cycles, drives the retry backoff
+        self.columns = None  # ColumnMapping of the sheet's header row, shared by every sync writing to the same tab
+        self.write_lock = asyncio.Lock()  # Serializes polled, webhook and backfill writes to the sheet (on the engine's loop)
+        self.sheet_index = None  # Lead dates found in the sheet on a first run, used to seed the ledger
+        self.last_synced_time = None  # Unix time of the newest lead written to the sheet (high-water mark)
+
+    @property
+    def target_id(self):
+        """Ledger key of the sheet written to: the spreadsheet, plus the tab when one is chosen"""
+        return f"{self.sheet_id}/{self.worksheet}" if self.worksheet else self.sheet_id
+
+class LeadLedger:
+    """SQLite record of every Graph lead handed to a sheet, used for dedupe and to resume after a restart"""
+    def __init__(self, path=LEDGER_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS leads (
+                    form_id TEXT NOT NULL,
+                    lead_id TEXT NOT NULL,
+                    sheet_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS leads_form_lead ON leads (form_id, lead_id, sheet_id);
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    form_id TEXT NOT NULL,
+                    sheet_id TEXT NOT NULL,
+                    last_synced_time INTEGER,
+                    PRIMARY KEY (form_id, sheet_id)
+                );
+                CREATE TABLE IF NOT EXISTS backfills (
+                    form_id TEXT NOT NULL,
+                    sheet_id TEXT NOT NULL,
+                    start_time INTEGER NOT NULL,
+                    end_time INTEGER NOT NULL,
+                    done_until INTEGER NOT NULL,
+                    PRIMARY KEY (form_id, sheet_id)
+                );
+            """)
+
+    def claim(self, form_id, sheet_id, lead_ids):
+        """Record unseen leads as pending and return the ids not yet written to the sheet"""
+        unwritten = set()
+        now = time.time()
+        with self.lock, self.conn:
+            for lead_id in lead_ids:
+                row = self.conn.execute(
+                    "SELECT status FROM leads WHERE form_id = ? AND lead_id = ? AND sheet_id = ?",
+                    (form_id, lead_id, sheet_id)).fetchone()
+                if row is None:
+                    self.conn.execute(
+                        "INSERT INTO leads (form_id, lead_id, sheet_id, status, updated_at) VALUES (?, ?, ?, 'pending', ?)",
+                        (form_id, lead_id, sheet_id, now))
+                if row is None or row[0] != "written":
+                    unwritten.add(lead_id)
+        return unwritten
+
+    def mark_written(self, form_id, sheet_id, lead_ids):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE leads SET status = 'written', updated_at = ? WHERE form_id = ? AND lead_id = ? AND sheet_id = ?",
+                [(now, form_id, lead_id, sheet_id) for lead_id in lead_ids])
+
+    def get_watermark(self, form_id, sheet_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT last_synced_time FROM sync_state WHERE form_id = ? AND sheet_id = ?",
+                (form_id, sheet_id)).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, form_id, sheet_id, last_synced_time):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO sync_state (form_id, sheet_id, last_synced_time) VALUES (?, ?, ?) "
+                "ON CONFLICT (form_id, sheet_id) DO UPDATE SET last_synced_time = excluded.last_synced_time",
+                (form_id, sheet_id, last_synced_time))
+
+    def get_backfill(self, form_id, sheet_id):
+        """Return (start_time, end_time, done_until) of the last backfill, or None"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT start_time, end_time, done_until FROM backfills WHERE form_id = ? AND sheet_id = ?",
+                (form_id, sheet_id)).fetchone()
+
+    def save_backfill(self, form_id, sheet_id, start_time, end_time, done_until):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO backfills (form_id, sheet_id, start_time, end_time, done_until) VALUES (?, ?, ?, ?, ?)",
+                (form_id, sheet_id, start_time, end_time, done_until))
+
+class SheetsClient:
+    """Sheets REST client for one Google credential, on the shared HTTP session"""
+    def __init__(self, session, token, limiter=None):
+        self.session = session
+        self.token = token
+        self.limiter = limiter
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.lock = threading.Lock()
+        self.spreadsheets = {}  # Spreadsheet id -> {worksheet title: sheetId}, in tab order
+        self.spreadsheet_locks = {}  # Spreadsheet id -> lock held while its worksheets are looked up
+
+    def request(self, method, spreadsheet_id, path, **kwargs):
+        response = self.session.request(method, f"{SHEETS_API_URL}/{spreadsheet_id}{path}", headers=self.headers, **kwargs)
+        if self.limiter:
+            self.limiter.observe_sheets(spreadsheet_id, response)
+        response.raise_for_status()
+        return response.json()
+
+    def worksheets(self, spreadsheet_id, refresh=False):
+        """Worksheet titles and ids of a spreadsheet, fetched once per client unless refresh is set"""
+        with self.lock:
+            lock = self.spreadsheet_locks.setdefault(spreadsheet_id, threading.Lock())
+        # Tabs of one spreadsheet opened at the same time wait for a single lookup
+        with lock:
+            if refresh:
+                self.spreadsheets.pop(spreadsheet_id, None)
+            if spreadsheet_id not in self.spreadsheets:
+                response = self.request("GET", spreadsheet_id, "", params={"fields": "sheets.properties(sheetId,title)"})
+                self.spreadsheets[spreadsheet_id] = {sheet["properties"]["title"]: sheet["properties"].get("sheetId", 0) for sheet in response["sheets"]}
+            return self.spreadsheets[spreadsheet_id]
+
+class SheetsWorksheet:
+    """One worksheet (the first one unless a title is given) of a spreadsheet"""
+    def __init__(self, client, spreadsheet_id, title=None, writer=None):
+        self.client = client
+        self.spreadsheet_id = spreadsheet_id
+        self.writer = writer
+        worksheets = client.worksheets(spreadsheet_id)
+        self.title = title or next(iter(worksheets))
+        if self.title not in worksheets:
+            # The tab may have been added since the spreadsheet was looked up
+            worksheets = client.worksheets(spreadsheet_id, refresh=True)
+        if self.title not in worksheets:
+            raise ValueError(f"No worksheet named {self.title}")
+        self.worksheet_id = worksheets[self.title]
+
+    def request(self, method, path, **kwargs):
+        return self.client.request(method, self.spreadsheet_id, path, **kwargs)
+
+    def values_path(self, cell_range):
+        return "/values/" + urllib.parse.quote(f"'{self.title}'!{cell_range}", safe="")
+
+    def col_values(self, col):
+        letter = chr(ord("A") + col - 1)
+        response = self.request("GET", self.values_path(f"{letter}:{letter}"), params={"majorDimension": "COLUMNS"})
+        values = response.get("values", [])
+        return values[0] if values else []
+
+    def row_values(self, row):
+        response = self.request("GET", self.values_path(f"{row}:{row}"))
+        values = response.get("values", [])
+        return values[0] if values else []
+
+    def update_row(self, row, values):
+        self.request("PUT", self.values_path(f"A{row}"), params={"valueInputOption": "RAW"}, json={"values": [values]})
+
+    def append_rows(self, rows):
+        if self.writer:
+            self.writer.append(self, rows).result()
+        else:
+            self.request("POST", self.values_path("A1") + ":append",
+                         params={"valueInputOption": "RAW", "insertDataOption": "INSERT_ROWS"},
+                         json={"values": rows})
+
+    def queue_append(self, rows):
+        """Queue rows on the shared writer and return a Future resolved once they are written"""
+        if self.writer:
+            return self.writer.append(self, rows)
+        future = Future()
+        try:
+            self.append_rows(rows)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(None)
+        return future
+
+class SheetsWriter:
+    """Shared Sheets access: one client per Google credential, and appends coalesced per spreadsheet
+
+    append() queues rows and returns a Future for their write. A flush thread waits
+    SHEETS_COALESCE_WINDOW_SECONDS after the first queued append (or not at all once
+    SHEETS_BATCH_MAX_ROWS rows are queued), then sends everything queued for a spreadsheet,
+    across all of its tabs, as one batchUpdate of appendCells requests. A spreadsheet has one
+    flush at a time, so its rows land in the order they were queued.
+    """
+    def __init__(self, session, limiter=None, window=SHEETS_COALESCE_WINDOW_SECONDS):
+        self.session = session
+        self.limiter = limiter
+        self.window = window
+        self.clients = {}  # Google token -> SheetsClient
+        self.pending = {}  # (Google token, spreadsheet id) -> [(worksheet, rows, future)]
+        self.pending_rows = {}  # Same keys -> rows queued
+        self.due = {}  # Same keys -> monotonic time their queued appends are flushed
+        self.flushing = set()  # Keys with a flush in progress
+        self.condition = threading.Condition()
+        # Flushes get their own threads, so they never wait behind the writers blocked on them
+        self.executor = ThreadPoolExecutor(max_workers=SHEETS_FLUSH_WORKERS, thread_name_prefix="leadeable-sheets")
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def client(self, token):
+        with self.condition:
+            if token not in self.clients:
+                self.clients[token] = SheetsClient(self.session, token, self.limiter)
+            return self.clients[token]
+
+    def worksheet(self, token, spreadsheet_id, title=None):
+        return SheetsWorksheet(self.client(token), spreadsheet_id, title, self)
+
+    def append(self, worksheet, rows):
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Sheets writer is closed")
+            key = (worksheet.client.token, worksheet.spreadsheet_id)
+            self.pending.setdefault(key, []).append((worksheet, rows, future))
+            self.pending_rows[key] = self.pending_rows.get(key, 0) + len(rows)
+            self.due.setdefault(key, time.monotonic() + self.window)
+            if self.pending_rows[key] >= SHEETS_BATCH_MAX_ROWS:
+                self.due[key] = time.monotonic()
+            self.condition.notify()
+        return future
+
+    def close(self):
+        """Stop the flush thread and pool; appends not sent yet fail instead of being written late"""
+        with self.condition:
+            self.closed = True
+            pending, self.pending = self.pending, {}
+            self.pending_rows.clear()
+            self.due.clear()
+            self.condition.notify()
+        for appends in pending.values():
+            for worksheet, rows, future in appends:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(RuntimeError("Sheets writer is closed"))
+        self.thread.join()
+        self.executor.shutdown()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.closed:
+                        return
+                    now = time.monotonic()
+                    # A spreadsheet's appends queued during its flush wait for the next one
+                    waiting = {key: due for key, due in self.due.items() if key not in self.flushing}
+                    ready = [key for key, due in waiting.items() if due <= now]
+                    if ready:
+                        break
+                    self.condition.wait(min(waiting.values()) - now if waiting else None)
+                flushes = []
+                for key in ready:
+                    del self.due[key], self.pending_rows[key]
+                    self.flushing.add(key)
+                    flushes.append((key, self.pending.pop(key)))
+            for key, appends in flushes:
+                self.executor.submit(self.flush, key, appends)
+
+    def flush(self, key, appends):
+        try:
+            # Appends whose waiter was cancelled (a stopped sync) are dropped
+            appends = [append for append in appends if append[2].set_running_or_notify_cancel()]
+            batch, rows_in_batch = [], 0
+            for append in appends:
+                if batch and rows_in_batch + len(append[1]) > SHEETS_BATCH_MAX_ROWS:
+                    self.send(batch)
+                    batch, rows_in_batch = [], 0
+                batch.append(append)
+                rows_in_batch += len(append[1])
+            if batch:
+                self.send(batch)
+        finally:
+            with self.condition:
+                self.flushing.discard(key)
+                self.condition.notify()
+
+    def send(self, appends):
+        worksheet = appends[0][0]
+        if self.limiter:
+            # One Sheets call per request, however many syncs' chunks it carries
+            delay = self.limiter.reserve(("sheets", worksheet.spreadsheet_id))
+            if delay > 0:
+                time.sleep(delay)
+        append_requests = [{"appendCells": {
+            "sheetId": sheet.worksheet_id,
+            "rows": [{"values": [{"userEnteredValue": {"stringValue": str(value)}} if value != "" else {} for value in row]} for row in rows],
+            "fields": "userEnteredValue"}} for sheet, rows, future in appends]
+        try:
+            worksheet.request("POST", ":batchUpdate", json={"requests": append_requests})
+        except Exception as e:
+            for sheet, rows, future in appends:
+                future.set_exception(e)
+        else:
+            for sheet, rows, future in appends:
+                future.set_result(None)
+
+class ColumnMapping:
+    """Lead field -> sheet column for one worksheet, compiled once from its header row
+
+    Syncs writing to the same tab share one mapping, so a question added by one sync's form
+    is never overwritten by another's stale header row. Hold lock while adding fields and
+    writing the header row.
+    """
+    def __init__(self, headers):
+        self.lock = threading.Lock()
+        self.headers = list(headers)
+        self.columns = {}
+        for i, header in enumerate(self.headers):
+            self.columns.setdefault(HEADER_FIELDS.get(header, header), i)
+        for header in SHEET_HEADERS:
+            self.add_field(HEADER_FIELDS[header], header)
+
+    def add_field(self, field, header=None):
+        if field in self.columns:
+            return False
+        self.columns[field] = len(self.headers)
+        self.headers.append(header or field)
+        return True
+
+    def add_fields(self, leads):
+        """Give every question not seen before its own column; returns whether the header row changed"""
+        added = False
+        for lead in leads:
+            for field in lead["field_data"]:
+                added = self.add_field(field["name"]) or added
+        return added
+
+    def row(self, lead):
+        row = [""] * len(self.headers)
+        row[self.columns["created_time"]] = lead["created_time"]
+        for field in lead["field_data"]:
+            row[self.columns[field["name"]]] = ", ".join(field["values"])
+        return row
+
+class LeadStream:
+    """One sync's lead pages, handed from the Graph batcher to the sync's sheet writes"""
+    def __init__(self):
+        self.pages = asyncio.Queue(maxsize=GRAPH_STREAM_BUFFER_PAGES)  # ("page", leads), ("error", exception) or ("done", None)
+        self.closed = False
+
+    async def put(self, kind, value):
+        if not self.closed:
+            await self.pages.put((kind, value))
+
+class SyncEngine:
+    """Runs every sync on one asyncio event loop, sharing a pooled HTTP session for Graph and Sheets"""
+    def __init__(self, on_status=None, on_stopped=None, max_concurrency=MAX_CONCURRENT_SYNCS, ledger=None):
+        self.on_status = on_status or logger.info
+        self.on_stopped = on_stopped or (lambda sync: None)
+        self.ledger = ledger or LeadLedger()
+        self.max_concurrency = max_concurrency
+        self.limiter = RateLimiter()
+        self.metrics = Metrics()
+
+        self.session = requests.Session()
+        pool_size = max_concurrency + SHEETS_FLUSH_WORKERS
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="leadeable-sync")
+        self.sheets_writer = SheetsWriter(self.session, self.limiter)
+
+        self.loop = asyncio.new_event_loop()
+        self.semaphore = None
+        self.queue = []  # Heap of (due time, sequence, generation, sync)
+        self.sequence = itertools.count()
+        self.queue_changed = None
+        self.pending_fetches = {}  # Access token -> [(sync, future)] waiting for the next Graph batch
+        self.fetch_timers = {}  # Access token -> timer handle flushing its pending fetches
+        self.active_syncs = set()
+        self.notified_leads = {}  # Form id -> lead ids announced by the webhook, not fetched yet
+        self.notify_timers = {}  # Form id -> timer handle fetching its notified leads
+        self.webhook_server = None
+        self.metrics_server = None
+        self.column_mappings = {}  # (spreadsheet id, tab title) -> ColumnMapping shared by the syncs writing there
+        self.column_mapping_locks = {}  # (spreadsheet id, tab title) -> lock held while its mapping is compiled
+        self.column_mappings_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run_loop, daemon=True)
+        self.thread.start()
+
+    def run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.queue_changed = asyncio.Event()
+        self.loop.create_task(self.run_scheduler())
+        self.loop.run_forever()
+
+    def submit(self, sync):
+        """Start running a sync (safe to call from any thread)"""
+        if not sync.running:
+            sync.running = True
+            sync.sheet = None
+            sync.failures = 0
+            self.loop.call_soon_threadsafe(self.activate, sync)
+
+    def cancel(self, sync):
+        """Stop a sync at once, even while a cycle is running"""
+        if sync.running:
+            sync.running = False
+            self.loop.call_soon_threadsafe(self.unschedule, sync)
+
+    def reschedule(self, sync):
+        """Apply a changed frequency to a waiting sync without waiting out its old interval"""
+        self.loop.call_soon_threadsafe(self.apply_frequency, sync)
+
+    def shutdown(self):
+        """Cancel every sync and stop the event loop, webhook server and worker pool"""
+        asyncio.run_coroutine_threadsafe(self.cancel_all(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        if self.webhook_server:
+            self.webhook_server.shutdown()
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+        self.sheets_writer.close()
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+    async def cancel_all(self):
+        for sync in list(self.active_syncs):
+            sync.running = False
+            self.unschedule(sync)
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        # Let the cancellations run before shutdown() stops the loop, or the tasks are destroyed pending
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def start_webhook(self, port=WEBHOOK_PORT, verify_token=WEBHOOK_VERIFY_TOKEN, app_secret=FACEBOOK_APP_SECRET, host=WEBHOOK_HOST):
+        """Serve leadgen webhook notifications; polling then drops to a reconciliation interval"""
+        if not app_secret and not is_loopback(host):
+            raise ValueError(f"Serving the webhook on {host} needs an app secret to verify notifications")
+        server = ThreadingHTTPServer((host, port), WebhookHandler)
+        server.context = {"verify_token": verify_token, "app_secret": app_secret, "engine": self}
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.webhook_server = server
+        return server
+
+    def start_metrics(self, port=METRICS_PORT, host="127.0.0.1"):
+        """Serve per-sync stage timings and counters for Prometheus at /metrics"""
+        self.metrics_server = start_metrics_server(self, port, host)
+        return self.metrics_server
+
+    def metrics_text(self):
+        rate_limits = [("leadeable_rate_limit_events_total", {"kind": kind}, value) for kind, value in self.limiter.stats().items()]
+        return self.metrics.render(rate_limits)
+
+    def start_backfill(self, sync, since=None):
+        """Backfill a sync's sheet with the form's history (safe to call from any thread)
+
+        Returns a concurrent.futures.Future resolving to the number of leads written.
+        """
+        return asyncio.run_coroutine_threadsafe(self.backfill(sync, since), self.loop)
+
+    def notify_leads(self, form_id, lead_ids):
+        """Queue leads announced by the webhook for an immediate fetch and write (safe to call from any thread)"""
+        self.loop.call_soon_threadsafe(self.queue_notified_leads, form_id, lead_ids)
+
+    def activate(self, sync):
+        self.active_syncs.add(sync)
+        # Syncs started together (daemon or app start) would otherwise all fire at once
+        spread = min(self.interval(sync), SCHEDULE_START_SPREAD_SECONDS)
+        self.schedule(sync, self.loop.time() + random.uniform(0, spread))
+
+    def schedule(self, sync, due):
+        sync.generation += 1
+        heapq.heappush(self.queue, (due, next(self.sequence), sync.generation, sync))
+        self.queue_changed.set()
+
+    def unschedule(self, sync):
+        sync.generation += 1
+        self.active_syncs.discard(sync)
+        if sync.task:
+            sync.task.cancel()
+            sync.task = None
+
+    def apply_frequency(self, sync):
+        # A running cycle picks the new frequency up when it reschedules itself
+        if sync.running and sync.task is None and sync.last_started is not None:
+            self.schedule(sync, self.next_due(sync))
+
+    def interval(self, sync):
+        delay = sync.frequency_minutes * 60
+        if self.webhook_server:
+            delay = max(delay, WEBHOOK_RECONCILE_MINUTES * 60)
+        return delay
+
+    def next_due(self, sync):
+        if sync.failures:
+            delay = min(ERROR_RETRY_BASE_SECONDS * 2 ** (sync.failures - 1), ERROR_RETRY_MAX_SECONDS)
+        else:
+            delay = self.interval(sync)
+        # Centred on the interval, so syncs drift apart without all running late
+        jitter = random.uniform(-1, 1) * min(delay * SCHEDULE_JITTER_FRACTION, SCHEDULE_JITTER_MAX_SECONDS)
+        return sync.last_started + delay + jitter
+
+    async def run_scheduler(self):
+        """Start each sync's cycle when its deadline comes up, in deadline order"""
+        while True:
+            self.queue_changed.clear()
+            # Drop entries of stopped syncs and entries superseded by a later (re)schedule
+            while self.queue and (not self.queue[0][3].running or self.queue[0][2] != self.queue[0][3].generation):
+                heapq.heappop(self.queue)
+            if self.queue and self.queue[0][0] <= self.loop.time():
+                due, _, _, sync = heapq.heappop(self.queue)
+                sync.task = self.loop.create_task(self.run_sync_cycle(sync, self.loop.time() - due))
+                continue
+            timeout = self.queue[0][0] - self.loop.time() if self.queue else None
+            try:
+                await asyncio.wait_for(self.queue_changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def setup_google_sheets(self, sync):
+        return self.sheets_writer.worksheet(sync.google_token, sync.sheet_id, sync.worksheet)
+
+    async def get_facebook_leads(self, sync):
+        """Yield pages of leads newer than the sync's high-water mark (every lead on the first run)
+
+        Fetches for syncs sharing an access token are coalesced into Graph batch requests, and
+        paging waits while GRAPH_STREAM_BUFFER_PAGES pages are still unconsumed.
+        """
+        stream = LeadStream()
+        token = sync.fb_access_token
+        pending = self.pending_fetches.setdefault(token, [])
+        pending.append((sync, stream))
+        if len(pending) >= GRAPH_BATCH_SIZE:
+            self.flush_fetches(token)
+        elif token not in self.fetch_timers:
+            self.fetch_timers[token] = self.loop.call_later(GRAPH_BATCH_WINDOW_SECONDS, self.flush_fetches, token)
+        try:
+            while True:
+                kind, value = await stream.pages.get()
+                if kind == "error":
+                    raise value
+                if kind == "done":
+                    return
+                yield value
+        finally:
+            # Unblock the batcher if it is waiting to hand this stream another page
+            stream.closed = True
+            while not stream.pages.empty():
+                stream.pages.get_nowait()
+
+    def flush_fetches(self, token):
+        timer = self.fetch_timers.pop(token, None)
+        if timer:
+            timer.cancel()
+        entries = self.pending_fetches.pop(token, [])
+        if entries:
+            self.loop.create_task(self.fetch_batch(token, entries))
+
+    def queue_notified_leads(self, form_id, lead_ids):
+        self.notified_leads.setdefault(form_id, set()).update(lead_ids)
+        if form_id not in self.notify_timers:
+            self.notify_timers[form_id] = self.loop.call_later(WEBHOOK_BATCH_WINDOW_SECONDS, self.flush_notified_leads, form_id)
+
+    def flush_notified_leads(self, form_id):
+        del self.notify_timers[form_id]
+        lead_ids = sorted(self.notified_leads.pop(form_id, ()))
+        # Syncs that have not opened their sheet yet pick these leads up on their first poll
+        syncs = [sync for sync in self.active_syncs if sync.form_id == form_id and sync.sheet is not None]
+        tokens = {}
+        for sync in syncs:
+            tokens.setdefault(sync.fb_access_token, []).append(sync)
+        for token, token_syncs in tokens.items():
+            self.loop.create_task(self.sync_notified_leads(token, token_syncs, lead_ids))
+
+    async def sync_notified_leads(self, token, syncs, lead_ids):
+        try:
+            await self.throttle(("graph", token), -(-len(lead_ids) // GRAPH_BATCH_SIZE))
+            leads = await self.run_blocking(self.get_leads_by_id, token, syncs[0].form_id, lead_ids)
+        except Exception as e:
+            self.on_status(f"Error ({', '.join(sync.name for sync in syncs)}): {str(e)}")
+            return
+        for sync in syncs:
+            # A sync may have been stopped or lost its sheet while the leads were fetched
+            if not (sync.running and sync.sheet is not None):
+                continue
+            try:
+                # The watermark stays put so the reconciliation poll still catches leads whose notification was lost
+                await self.write_leads(sync.sheet, sync, leads)
+            except Exception as e:
+                self.on_status(f"Error ({sync.name}): {str(e)}")
+
+    def get_leads_by_id(self, token, form_id, lead_ids):
+        """Fetch specific leads of a form, up to GRAPH_BATCH_SIZE ids per request
+
+        Leads of any other form are dropped, so a notification naming the wrong form cannot
+        write them to this form's sheets.
+        """
+        leads = []
+        for start in range(0, len(lead_ids), GRAPH_BATCH_SIZE):
+            params = {"ids": ",".join(lead_ids[start:start + GRAPH_BATCH_SIZE]), "fields": "id,created_time,field_data,form_id", "access_token": token}
+            http_response = self.session.get(GRAPH_API_URL + "/", params=params)
+            self.limiter.observe_graph(token, http_response.headers)
+            response = http_response.json()
+            if "error" in response:
+                self.limiter.observe_graph_error(token, response["error"])
+                raise RuntimeError(f"Error with Facebook API: {response['error']}")
+            leads.extend(lead for lead in response.values() if isinstance(lead, dict) and str(lead.get("form_id")) == form_id)
+        return sorted(leads, key=lambda lead: lead["created_time"])
+
+    def leads_query(self, sync):
+        """Relative Graph URL for the first page of a sync's leads"""
+        params = {"fields": "id,created_time,field_data", "limit": GRAPH_PAGE_SIZE}
+        if sync.last_synced_time is not None:
+            # Overlap by one second so leads sharing the watermark's second are not missed; the ledger drops repeats
+            params["filtering"] = json.dumps([{"field": "time_created", "operator": "GREATER_THAN", "value": sync.last_synced_time - 1}])
+        return f"{sync.form_id}/leads?{urllib.parse.urlencode(params)}"
+
+    async def fetch_batch(self, token, entries):
+        """Stream every page to each (sync, stream) entry, up to GRAPH_BATCH_SIZE requests per batch call"""
+        queries = {i: self.leads_query(sync) for i, (sync, stream) in enumerate(entries)}
+        while queries:
+            items = list(queries.items())
+            for start in range(0, len(items), GRAPH_BATCH_SIZE):
+                chunk = items[start:start + GRAPH_BATCH_SIZE]
+                try:
+                    await self.throttle(("graph", token), len(chunk))
+                    responses = await self.run_blocking(self.post_graph_batch, token, [query for i, query in chunk])
+                except Exception as e:
+                    responses = [e] * len(chunk)
+                deliveries = []
+                for (i, query), response in zip(chunk, responses):
+                    stream = entries[i][1]
+                    if stream.closed:
+                        del queries[i]
+                        continue
+                    try:
+                        page = self.parse_batch_response(response)
+                    except Exception as e:
+                        # Fail only this sync; its watermark stays put so the next cycle refetches
+                        del queries[i]
+                        deliveries.append(stream.put("error", e))
+                        continue
+                    deliveries.append(stream.put("page", page["data"]))
+                    next_query = self.next_page_query(page)
+                    if next_query:
+                        # Follow-up pages go into the next batch round
+                        queries[i] = next_query
+                    else:
+                        del queries[i]
+                        deliveries.append(stream.put("done", None))
+                # Wait for slow consumers together, so one sync's writes hold paging back only once per round
+                await asyncio.gather(*deliveries)
+
+    def next_page_query(self, page):
+        """Relative Graph URL of the page after this one (the path drops the API version prefix), or None"""
+        next_url = page.get("paging", {}).get("next")
+        if not next_url:
+            return None
+        parts = urllib.parse.urlsplit(next_url)
+        return parts.path.split("/", 2)[2] + "?" + parts.query
+
+    def get_graph_page(self, token, query):
+        http_response = self.session.get(f"{GRAPH_API_URL}/{query}", params={"access_token": token})
+        self.limiter.observe_graph(token, http_response.headers)
+        response = http_response.json()
+        if "error" in response:
+            self.limiter.observe_graph_error(token, response["error"])
+            raise RuntimeError(f"Error with Facebook API: {response['error']}")
+        return response
+
+    def post_graph_batch(self, token, queries):
+        batch = [{"method": "GET", "relative_url": query} for query in queries]
+        http_response = self.session.post(GRAPH_API_URL + "/", data={"access_token": token, "batch": json.dumps(batch)})
+        self.limiter.observe_graph(token, http_response.headers)
+        response = http_response.json()
+        if not isinstance(response, list):
+            self.limiter.observe_graph_error(token, response.get("error"))
+            raise RuntimeError(f"Error with Facebook API: {response.get('error', 'Unknown error')}")
+        for item in response:
+            if item:
+                # Each batched call reports its own usage headers and errors
+                self.limiter.observe_graph(token, {header["name"]: header["value"] for header in item.get("headers", [])})
+                if item.get("code") != 200:
+                    try:
+                        self.limiter.observe_graph_error(token, json.loads(item.get("body") or "{}").get("error"))
+                    except ValueError:
+                        pass
+        return response
+
+    def parse_batch_response(self, response):
+        if isinstance(response, Exception):
+            raise response
+        if response is None:
+            raise RuntimeError("Error with Facebook API: batch request timed out")
+        body = json.loads(response.get("body") or "{}")
+        if response.get("code") != 200 or "data" not in body:
+            raise RuntimeError(f"Error with Facebook API: {body.get('error', 'Unknown error')}")
+        return body
+
+    def latest_lead_time(self, leads, current):
+        """Return the newest lead creation time as Unix time, or current if there is nothing newer"""
+        for lead in leads:
+            created = graph_time(lead["created_time"])
+            if current is None or created > current:
+                current = created
+        return current
+
+    def process_lead_data(self, leads, columns):
+        """Turn leads into sheet rows one at a time, laid out by the sheet's column mapping"""
+        for lead in leads:
+            yield columns.row(lead)
+
+    def prepare_sheet(self, sheet, sync, stats=None):
+        """Compile the sheet's column mapping and restore the sync's watermark from the ledger"""
+        stats = stats or CycleStats()
+        sync.columns = self.column_mapping(sheet, sync, stats)
+
+        sync.last_synced_time = self.ledger.get_watermark(sync.form_id, sync.target_id)
+        sync.sheet_index = None
+        if sync.last_synced_time is None:
+            # First run against this sheet: remember the dates an earlier version may already
+            # have written so they are not appended twice
+            with stats.stage("sheet_read"):
+                sync.sheet_index = set(sheet.col_values(sync.columns.columns["created_time"] + 1)[1:])
+
+    def column_mapping(self, sheet, sync, stats):
+        """The tab's shared column mapping, compiled from its header row by the first sync to open it"""
+        key = (sync.sheet_id, sheet.title)
+        with self.column_mappings_lock:
+            lock = self.column_mapping_locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self.column_mappings:
+                with stats.stage("sheet_read"):
+                    headers = sheet.row_values(1)
+                if not headers:
+                    headers = list(SHEET_HEADERS)
+                    with stats.stage("sheet_write"):
+                        sheet.update_row(1, headers)
+                self.column_mappings[key] = ColumnMapping(headers)
+            return self.column_mappings[key]
+
+    def prepare_rows(self, sheet, leads, sync, chunk_size=SHEETS_APPEND_CHUNK_SIZE, stats=None):
+        """Claim the leads in the ledger and build rows for those not written yet (blocking, runs on the worker pool)
+
+        Returns [(lead ids, rows)], one entry per append of up to chunk_size rows.
+        """
+        stats = stats or CycleStats()
+        unwritten = self.ledger.claim(sync.form_id, sync.target_id, [lead["id"] for lead in leads])
+        new_leads = []
+        for lead in leads:
+            if lead["id"] in unwritten:
+                unwritten.discard(lead["id"])
+                new_leads.append(lead)
+
+        if sync.sheet_index:
+            already_written = [lead for lead in new_leads if lead["created_time"] in sync.sheet_index]
+            self.ledger.mark_written(sync.form_id, sync.target_id, [lead["id"] for lead in already_written])
+            new_leads = [lead for lead in new_leads if lead["created_time"] not in sync.sheet_index]
+
+        chunks = []
+        for start in range(0, len(new_leads), chunk_size):
+            chunk = new_leads[start:start + chunk_size]
+            with sync.columns.lock:
+                with stats.stage("transform"):
+                    new_fields = sync.columns.add_fields(chunk)
+                    rows = list(self.process_lead_data(chunk, sync.columns))
+                if new_fields:
+                    with stats.stage("sheet_write"):
+                        sheet.update_row(1, sync.columns.headers)
+            chunks.append(([lead["id"] for lead in chunk], rows))
+        return chunks
+
+    async def write_leads(self, sheet, sync, leads, chunk_size=SHEETS_APPEND_CHUNK_SIZE, stats=None):
+        """Write fetched leads to the sheet and return the rows appended
+
+        Only building the rows takes a worker slot; the wait for the shared writer's coalesced
+        flush happens on the loop, so it never holds other syncs' calls back.
+        """
+        stats = stats or CycleStats()
+        pending = deque()
+        async with sync.write_lock:
+            await self.queue_leads(sheet, sync, leads, pending, chunk_size, stats)
+            written = await self.confirm_writes(sync, pending, stats)
+        if written:
+            self.on_status(f"New leads ({sync.name}): {written}")
+        return written
+
+    async def queue_leads(self, sheet, sync, leads, pending, chunk_size=SHEETS_APPEND_CHUNK_SIZE, stats=None):
+        """Build rows for the leads and queue every chunk on the writer, adding (lead ids, rows, future) to pending
+
+        Hold sync.write_lock until confirm_writes has taken the chunks off pending, so no other
+        write claims the same leads meanwhile.
+        """
+        stats = stats or CycleStats()
+        chunks = await self.run_blocking(self.prepare_rows, sheet, leads, sync, chunk_size, stats)
+        # One append per chunk instead of one per lead, all queued before any is awaited so they
+        # share the writer's requests instead of each waiting out its coalescing window.
+        # Columns are only ever added at the end, so rows built before another sync's new column stay aligned.
+        for lead_ids, rows in chunks:
+            pending.append((lead_ids, rows, asyncio.wrap_future(sheet.queue_append(rows))))
+
+    async def confirm_writes(self, sync, pending, stats=None, keep_rows=0):
+        """Wait for queued chunks oldest first, marking each written as it lands, until at most keep_rows rows are left
+
+        Returns the rows confirmed. If a write fails, the chunks queued after it are cancelled.
+        """
+        stats = stats or CycleStats()
+        written = 0
+        unconfirmed = sum(len(rows) for lead_ids, rows, future in pending)
+        try:
+            while pending and unconfirmed > keep_rows:
+                lead_ids, rows, future = pending[0]
+                with stats.stage("sheet_write"):
+                    await future
+                pending.popleft()
+                unconfirmed -= len(rows)
+                stats.count("rows_written", len(rows))
+                written += len(rows)
+                # A crash between the append and mark_written leaves the chunk pending, so it is retried (at-least-once) on restart
+                await self.run_blocking(self.ledger.mark_written, sync.form_id, sync.target_id, lead_ids)
+        except BaseException:
+            for lead_ids, rows, future in pending:
+                future.cancel()
+            pending.clear()
+            raise
+        return written
+
+    async def commit_watermark(self, sync, last_synced_time):
+        """Advance the watermark once every page of a fetch is committed to the sheet"""
+        async with sync.write_lock:
+            if last_synced_time is not None and (sync.last_synced_time is None or last_synced_time > sync.last_synced_time):
+                sync.last_synced_time = last_synced_time
+                await self.run_blocking(self.ledger.set_watermark, sync.form_id, sync.target_id, last_synced_time)
+            sync.sheet_index = None
+
+    async def stream_leads(self, sync, stats=None):
+        """Fetch pages and queue them in chunks of up to SHEETS_APPEND_CHUNK_SIZE rows as they arrive
+
+        Paging carries on while up to SHEETS_STREAM_QUEUED_ROWS rows wait on the writer. The
+        write lock is held until they are all confirmed, so webhook writes for the sync wait.
+        """
+        stats = stats or CycleStats()
+        newest = sync.last_synced_time
+        buffered = []
+        pending = deque()
+        written = 0
+        pages = self.get_facebook_leads(sync)
+        try:
+            async with sync.write_lock:
+                while True:
+                    # Time spent waiting on the next page; pages fetched ahead while writing cost nothing here
+                    with stats.stage("graph_fetch"):
+                        try:
+                            page = await pages.__anext__()
+                        except StopAsyncIteration:
+                            break
+                    stats.count("graph_pages")
+                    stats.count("leads_fetched", len(page))
+                    newest = self.latest_lead_time(page, newest)
+                    buffered.extend(page)
+                    if len(buffered) >= SHEETS_APPEND_CHUNK_SIZE:
+                        await self.queue_buffered(sync, buffered, pending, stats)
+                        buffered = []
+                        written += await self.confirm_writes(sync, pending, stats, SHEETS_STREAM_QUEUED_ROWS)
+                if buffered:
+                    await self.queue_buffered(sync, buffered, pending, stats)
+                written += await self.confirm_writes(sync, pending, stats)
+        finally:
+            await pages.aclose()
+        if written:
+            self.on_status(f"New leads ({sync.name}): {written}")
+        with stats.stage("ledger"):
+            await self.commit_watermark(sync, newest)
+
+    async def queue_buffered(self, sync, leads, pending, stats):
+        # Graph pages come newest first; the webhook and backfill paths append oldest first
+        leads = sorted(leads, key=lambda lead: lead["created_time"])
+        await self.queue_leads(sync.sheet, sync, leads, pending, SHEETS_APPEND_CHUNK_SIZE, stats)
+
+    async def run_blocking(self, func, *args):
+        # Waiting for a slot stays cancellable; once a call holds one it never queues in the executor
+        async with self.semaphore:
+            return await self.loop.run_in_executor(self.executor, func, *args)
+
+    async def throttle(self, key, cost=1):
+        """Wait until key's token bucket allows cost more calls"""
+        delay = self.limiter.reserve(key, cost)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def open_sheet(self, sync, stats=None):
+        if sync.sheet is None:
+            sheet = await self.run_blocking(self.setup_google_sheets, sync)
+            await self.run_blocking(self.prepare_sheet, sheet, sync, stats)
+            sync.sheet = sheet
+
+    async def fetch_window(self, sync, start, end):
+        """Fetch every lead created in [start, end), oldest first"""
+        params = {"fields": "id,created_time,field_data", "limit": GRAPH_PAGE_SIZE, "filtering": json.dumps([
+            {"field": "time_created", "operator": "GREATER_THAN", "value": start - 1},
+            {"field": "time_created", "operator": "LESS_THAN", "value": end}])}
+        query = f"{sync.form_id}/leads?{urllib.parse.urlencode(params)}"
+        leads = []
+        while query:
+            await self.throttle(("graph", sync.fb_access_token))
+            page = await self.run_blocking(self.get_graph_page, sync.fb_access_token, query)
+            leads.extend(page["data"])
+            query = self.next_page_query(page)
+        return sorted(leads, key=lambda lead: lead["created_time"])
+
+    async def backfill(self, sync, since=None):
+        """Write the form's history to the sheet, fetching time windows in parallel
+
+        Progress is checkpointed in the ledger after each window, so an interrupted backfill
+        resumes from the last written window. Returns the number of rows appended.
+        """
+        try:
+            await self.open_sheet(sync)
+            # Starting the sync meanwhile resets sync.sheet; keep writing through this handle
+            sheet = sync.sheet
+            state = await self.run_blocking(self.ledger.get_backfill, sync.form_id, sync.target_id)
+            if state and state[2] < state[1]:
+                start, end, done_until = state
+                self.on_status(f"Backfill ({sync.name}): resuming from {datetime.fromtimestamp(done_until):%Y-%m-%d}")
+            else:
+                if since is None:
+                    form = await self.run_blocking(self.get_graph_page, sync.fb_access_token, f"{sync.form_id}?fields=created_time")
+                    since = graph_time(form["created_time"])
+                start, end = since, int(time.time())
+                done_until = start
+                await self.run_blocking(self.ledger.save_backfill, sync.form_id, sync.target_id, start, end, done_until)
+
+            window = BACKFILL_WINDOW_DAYS * 86400
+            windows = iter([(t, min(t + window, end)) for t in range(done_until, end, window)])
+            # Windows are fetched up to BACKFILL_WORKERS ahead, but written strictly in time order
+            in_flight = deque()
+            for window_start, window_end in itertools.islice(windows, BACKFILL_WORKERS):
+                in_flight.append((window_end, self.loop.create_task(self.fetch_window(sync, window_start, window_end))))
+            written = 0
+            try:
+                while in_flight:
+                    window_end, task = in_flight.popleft()
+                    leads = await task
+                    written += await self.write_leads(sheet, sync, leads, BACKFILL_APPEND_CHUNK_SIZE)
+                    await self.run_blocking(self.ledger.save_backfill, sync.form_id, sync.target_id, start, end, window_end)
+                    self.on_status(f"Backfill ({sync.name}): {written} leads, {100 * (window_end - start) // max(end - start, 1)}%")
+                    for window_start, next_end in itertools.islice(windows, 1):
+                        in_flight.append((next_end, self.loop.create_task(self.fetch_window(sync, window_start, next_end))))
+            finally:
+                for window_end, task in in_flight:
+                    task.cancel()
+
+            # Everything before the backfill started is in the sheet; polling carries on from there
+            await self.commit_watermark(sync, end)
+            self.on_status(f"Backfill ({sync.name}): done, {written} leads")
+            return written
+        except Exception as e:
+            self.on_status(f"Backfill error ({sync.name}): {str(e)}")
+            raise
+
+    def record_cycle(self, sync, stats, result, error=None):
+        """Add a finished cycle to the metrics and log it as one JSON line"""
+        self.metrics.record_cycle(sync.name, stats, result)
+        cycle_logger.info(json.dumps({
+            "sync": sync.name,
+            "form_id": sync.form_id,
+            "result": result,
+            "seconds": round(stats.elapsed(), 3),
+            "stages": {stage: round(seconds, 3) for stage, seconds in stats.seconds.items()},
+            "counts": stats.counts,
+            "error": str(error) if error else None,
+        }))
+
+    async def run_sync_cycle(self, sync, lag=0):
+        # Hold the cycle back while its token or spreadsheet is near or over a rate limit
+        delay = self.limiter.defer_delay([("graph", sync.fb_access_token), ("sheets", sync.sheet_id)])
+        if delay > 0:
+            self.on_status(f"Deferred ({sync.name}): rate limit, retrying in {int(delay)}s")
+            sync.task = None
+            if sync.running:
+                jitter = random.uniform(0, min(delay * SCHEDULE_JITTER_FRACTION, SCHEDULE_JITTER_MAX_SECONDS))
+                self.schedule(sync, self.loop.time() + delay + jitter)
+            return
+
+        stats = CycleStats()
+        stats.add("scheduler_lag", max(lag, 0))
+        error = None
+        try:
+            sync.last_started = self.loop.time()
+            if sync.sheet is None:
+                try:
+                    await self.open_sheet(sync, stats)
+                except Exception as e:
+                    if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code == 429:
+                        raise  # Rate limited, not misconfigured: retry with backoff instead of stopping
+                    self.on_status(f"Google Sheets error ({sync.name}): {str(e)}")
+                    self.record_cycle(sync, stats, "stopped", e)
+                    sync.running = False
+                    sync.task = None
+                    self.active_syncs.discard(sync)
+                    self.on_stopped(sync)
+                    return
+            if sync.last_synced_time is None:
+                # A backfill in progress writes everything before its end; poll only what came after
+                with stats.stage("ledger"):
+                    state = await self.run_blocking(self.ledger.get_backfill, sync.form_id, sync.target_id)
+                if state and state[2] < state[1]:
+                    sync.last_synced_time = state[1]
+            self.on_status(f"Checking ({sync.name}): {datetime.now().strftime('%H:%M:%S')}")
+            await self.stream_leads(sync, stats)
+            sync.failures = 0
+            self.on_status(f"Waiting ({sync.name})...")
+        except Exception as e:
+            error = e
+            sync.failures += 1
+            self.on_status(f"Error ({sync.name}): {str(e)}")
+        self.record_cycle(sync, stats, "error" if error else "ok", error)
+        sync.task = None
+        if sync.running:
+            self.schedule(sync, self.next_due(sync))
@@ -1,18 +1,14 @@
 import requests
-import gspread
-import time
-from datetime import datetime
 import customtkinter as ctk
-import threading
 import webbrowser
 from http.server import HTTPServer, BaseHTTPRequestHandler
 import urllib.parse
 from PIL import Image, ImageTk
-from google.oauth2.credentials import Credentials
 import logging
+import queue
+
+from .engine import SyncConfig, SyncEngine, WEBHOOK_ENABLED, METRICS_ENABLED
 
-# Configure logging for tracking errors
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Google API settings (statically defined)
@@ -20,6 +16,9 @@ GOOGLE_CLIENT_ID = "YOUR GOOGLE CLIENT ID"
 GOOGLE_CLIENT_SECRET = "YOUR CLIENT SECRET"
 GOOGLE_REDIRECT_URI = "http://localhost:8000/callback"
 
+# UI settings
+UI_FRAME_MS = 16  # Queued status and sync changes are applied at most once per frame
+
 class OAuthHandler(BaseHTTPRequestHandler):
     def do_GET(self):
         query = urllib.parse.urlparse(self.path).query
@@ -37,18 +36,6 @@ class OAuthHandler(BaseHTTPRequestHandler):
         else:
             self.send_error(404)
 
-class SyncConfig:
-    def __init__(self, name, fb_access_token, ad_account_id, form_id, sheet_id, frequency_minutes, google_token):
-        self.name = name
-        self.fb_access_token = fb_access_token
-        self.ad_account_id = ad_account_id
-        self.form_id = form_id
-        self.sheet_id = sheet_id
-        self.frequency_minutes = frequency_minutes
-        self.google_token = google_token
-        self.running = False
-        self.thread = None
-
 class LeadableApp:
     def __init__(self, root):
         self.root = root
@@ -59,6 +46,14 @@ class LeadableApp:
         self.google_token = None
         self.sheets = []
         self.syncs = []
+        # Engine callbacks run on its threads; they only queue events, which the Tk thread applies
+        self.ui_events = queue.Queue()
+        self.engine = SyncEngine(on_status=lambda message: self.post("status", message),
+                                 on_stopped=lambda sync: self.post("sync", sync))
+        if WEBHOOK_ENABLED:
+            self.engine.start_webhook()
+        if METRICS_ENABLED:
+            self.engine.start_metrics()
 
         # Load icon (only as window icon, removed from the interface)
         icon_pil = Image.open("leadable_icon.png").convert("RGBA")  # Ensure it's in RGBA mode
@@ -155,12 +150,14 @@ class LeadableApp:
         self.sync_frame.bind("<Configure>", lambda e: self.sync_canvas.configure(scrollregion=self.sync_canvas.bbox("all")))
         self.sync_canvas.configure(yscrollcommand=self.sync_scrollbar.set)
 
-        self.sync_list = []  # List of synchronization widgets
+        self.sync_rows = {}  # Sync -> its row's widgets and the text and running state they show
 
         # Status
         self.status_label = ctk.CTkLabel(root, text="Status: Stopped", text_color="#666666", font=("Inter", 12))
         self.status_label.pack(pady=20)
 
+        self.root.after(UI_FRAME_MS, self.drain_events)
+
     def google_login(self):
         auth_url = f"https://accounts.google.com/o/oauth2/v2/auth?client_id={GOOGLE_CLIENT_ID}&redirect_uri={GOOGLE_REDIRECT_URI}&scope=https://www.googleapis.com/auth/spreadsheets+https://www.googleapis.com/auth/drive.readonly&response_type=code&access_type=offline"
         webbrowser.open(auth_url)
@@ -229,59 +226,117 @@ class LeadableApp:
 
             sync = SyncConfig(name, fb_access_token, ad_account_id, form_id, selected_sheet["id"], frequency_minutes, self.google_token)
             self.syncs.append(sync)
-            self.update_sync_list()
             self.start_sync(sync)
         except ValueError as e:
             ctk.CTkMessageBox(master=self.root, title="Error", message=str(e), icon="warning")
 
-    def update_sync_list(self):
-        # Clear previous widgets
-        for widget in self.sync_list:
-            widget.destroy()
-        self.sync_list.clear()
-
-        # Add new synchronizations with icons and animations
-        for i, sync in enumerate(self.syncs):
-            frame = ctk.CTkFrame(self.sync_frame, fg_color="#FFFFFF", corner_radius=0, border_width=0)
-            frame.pack(fill="x", pady=8)
-
-            # Synchronization name and details
-            label = ctk.CTkLabel(frame, text=f"{i+1}. {sync.name} - {sync.frequency_minutes} min", text_color="#333333", font=("Inter", 12))
-            label.pack(side="left", padx=20, pady=10)
+    def post(self, kind, value):
+        """Queue a UI change: ("status", message) or ("sync", sync). Safe to call from any thread"""
+        self.ui_events.put((kind, value))
 
-            # Function buttons (Unicode icons)
-            buttons_frame = ctk.CTkFrame(frame, fg_color="#FFFFFF", corner_radius=0, border_width=0)
-            buttons_frame.pack(side="right")
-
-            # Timing edit (⏱️ icon, with animation)
-            edit_button = ctk.CTkButton(buttons_frame, text="⏱️", command=lambda s=sync: self.edit_timing(s), fg_color="#0013FF", hover_color="#0033FF", corner_radius=6, text_color="#FFFFFF", font=("Inter", 16, "bold"), height=32, width=32)
-            edit_button.pack(side="left", padx=5)
-            edit_button.bind("<Enter>", lambda e, b=edit_button: b.configure(fg_color="#0033FF"))  # Hover animation
-            edit_button.bind("<Leave>", lambda e, b=edit_button: b.configure(fg_color="#0013FF"))
-
-            # Start/Stop (with animation)
+    def drain_events(self):
+        # Apply everything queued since the last frame: only the newest status is shown,
+        # and only the rows of syncs that changed are touched
+        status, changed = None, set()
+        try:
+            while True:
+                kind, value = self.ui_events.get_nowait()
+                if kind == "status":
+                    status = value
+                else:
+                    changed.add(value)
+        except queue.Empty:
+            pass
+        try:
+            if status is not None:
+                self.update_status(status)
+            if changed:
+                self.update_sync_list(changed)
+        finally:
+            self.root.after(UI_FRAME_MS, self.drain_events)
+
+    def update_sync_list(self, changed):
+        """Bring the rows of the changed syncs in line with self.syncs; rows after a removed one are renumbered"""
+        renumber_from = None
+        for sync in changed:
+            row = self.sync_rows.get(sync)
+            # A row's index is only stale once a sync before it was removed, so the list is searched only then
+            if row is None or row["index"] >= len(self.syncs) or self.syncs[row["index"]] is not sync:
+                if sync not in self.syncs:
+                    if row is not None:
+                        del self.sync_rows[sync]
+                        row["frame"].destroy()
+                        row["separator"].destroy()
+                        renumber_from = row["index"] if renumber_from is None else min(renumber_from, row["index"])
+                    continue
+                if row is None:
+                    row = self.create_sync_row(sync)
+                row["index"] = self.syncs.index(sync)
+            self.refresh_sync_row(sync, row)
+
+        if renumber_from is not None:
+            for i in range(renumber_from, len(self.syncs)):
+                row = self.sync_rows.get(self.syncs[i])
+                if row is not None:
+                    row["index"] = i
+                    self.refresh_sync_row(self.syncs[i], row)
+
+    def refresh_sync_row(self, sync, row):
+        text = f"{row['index']+1}. {sync.name} - {sync.frequency_minutes} min"
+        if text != row["text"]:
+            row["label"].configure(text=text)
+            row["text"] = text
+        if sync.running != row["running"]:
             if sync.running:
-                stop_button = ctk.CTkButton(buttons_frame, text="⏹️", command=lambda s=sync: self.stop_sync(s), fg_color="#FF4D4F", hover_color="#FF3335", corner_radius=6, text_color="#FFFFFF", font=("Inter", 16, "bold"), height=32, width=32)
-                stop_button.pack(side="left", padx=5)
-                stop_button.bind("<Enter>", lambda e, b=stop_button: b.configure(fg_color="#FF3335"))  # Hover animation
-                stop_button.bind("<Leave>", lambda e, b=stop_button: b.configure(fg_color="#FF4D4F"))
+                row["toggle"].configure(text="⏹️", command=lambda s=sync: self.stop_sync(s), fg_color="#FF4D4F", hover_color="#FF3335")
             else:
-                start_button = ctk.CTkButton(buttons_frame, text="▶️", command=lambda s=sync: self.start_sync(s), fg_color="#0013FF", hover_color="#0033FF", corner_radius=6, text_color="#FFFFFF", font=("Inter", 16, "bold"), height=32, width=32)
-                start_button.pack(side="left", padx=5)
-                start_button.bind("<Enter>", lambda e, b=start_button: b.configure(fg_color="#0033FF"))  # Hover animation
-                start_button.bind("<Leave>", lambda e, b=start_button: b.configure(fg_color="#0013FF"))
-
-            # Delete (🗑️ icon, with animation)
-            delete_button = ctk.CTkButton(buttons_frame, text="🗑️", command=lambda s=sync: self.delete_sync(s, None), fg_color="#FF4D4F", hover_color="#FF3335", corner_radius=6, text_color="#FFFFFF", font=("Inter", 16, "bold"), height=32, width=32)
-            delete_button.pack(side="left", padx=5)
-            delete_button.bind("<Enter>", lambda e, b=delete_button: b.configure(fg_color="#FF3335"))  # Hover animation
-            delete_button.bind("<Leave>", lambda e, b=delete_button: b.configure(fg_color="#FF4D4F"))
-
-            # Separator line
-            separator = ctk.CTkFrame(self.sync_frame, fg_color="#E0E0E0", height=1)
-            separator.pack(fill="x", pady=8)
-
-            self.sync_list.append(frame)
+                row["toggle"].configure(text="▶️", command=lambda s=sync: self.start_sync(s), fg_color="#0013FF", hover_color="#0033FF")
+            row["running"] = sync.running
+
+    def create_sync_row(self, sync):
+        """Build the widgets of one sync's row; refresh_sync_row fills in its text and start/stop state"""
+        frame = ctk.CTkFrame(self.sync_frame, fg_color="#FFFFFF", corner_radius=0, border_width=0)
+        frame.pack(fill="x", pady=8)
+
+        # Synchronization name and details
+        label = ctk.CTkLabel(frame, text="", text_color="#333333", font=("Inter", 12))
+        label.pack(side="left", padx=20, pady=10)
+
+        # Function buttons (Unicode icons)
+        buttons_frame = ctk.CTkFrame(frame, fg_color="#FFFFFF", corner_radius=0, border_width=0)
+        buttons_frame.pack(side="right")
+
+        # Timing edit (⏱️ icon, with animation)
+        edit_button = ctk.CTkButton(buttons_frame, text="⏱️", command=lambda s=sync: self.edit_timing(s), fg_color="#0013FF", hover_color="#0033FF", corner_radius=6, text_color="#FFFFFF", font=("Inter", 16, "bold"), height=32, width=32)
+        edit_button.pack(side="left", padx=5)
+        edit_button.bind("<Enter>", lambda e, b=edit_button: b.configure(fg_color="#0033FF"))  # Hover animation
+        edit_button.bind("<Leave>", lambda e, b=edit_button: b.configure(fg_color="#0013FF"))
+
+        # Start/Stop (with animation), switched over in place as the sync starts and stops
+        toggle_button = ctk.CTkButton(buttons_frame, text="", corner_radius=6, text_color="#FFFFFF", font=("Inter", 16, "bold"), height=32, width=32)
+        toggle_button.pack(side="left", padx=5)
+        toggle_button.bind("<Enter>", lambda e, s=sync, b=toggle_button: b.configure(fg_color="#FF3335" if s.running else "#0033FF"))  # Hover animation
+        toggle_button.bind("<Leave>", lambda e, s=sync, b=toggle_button: b.configure(fg_color="#FF4D4F" if s.running else "#0013FF"))
+
+        # Backfill history (⏬ icon, with animation)
+        backfill_button = ctk.CTkButton(buttons_frame, text="⏬", command=lambda s=sync: self.backfill_sync(s), fg_color="#0013FF", hover_color="#0033FF", corner_radius=6, text_color="#FFFFFF", font=("Inter", 16, "bold"), height=32, width=32)
+        backfill_button.pack(side="left", padx=5)
+        backfill_button.bind("<Enter>", lambda e, b=backfill_button: b.configure(fg_color="#0033FF"))  # Hover animation
+        backfill_button.bind("<Leave>", lambda e, b=backfill_button: b.configure(fg_color="#0013FF"))
+
+        # Delete (🗑️ icon, with animation)
+        delete_button = ctk.CTkButton(buttons_frame, text="🗑️", command=lambda s=sync: self.delete_sync(s, None), fg_color="#FF4D4F", hover_color="#FF3335", corner_radius=6, text_color="#FFFFFF", font=("Inter", 16, "bold"), height=32, width=32)
+        delete_button.pack(side="left", padx=5)
+        delete_button.bind("<Enter>", lambda e, b=delete_button: b.configure(fg_color="#FF3335"))  # Hover animation
+        delete_button.bind("<Leave>", lambda e, b=delete_button: b.configure(fg_color="#FF4D4F"))
+
+        # Separator line
+        separator = ctk.CTkFrame(self.sync_frame, fg_color="#E0E0E0", height=1)
+        separator.pack(fill="x", pady=8)
+
+        row = {"frame": frame, "separator": separator, "label": label, "toggle": toggle_button, "index": None, "text": None, "running": None}
+        self.sync_rows[sync] = row
+        return row
 
     def edit_timing(self, sync):
         """Edit timing in a separate window"""
@@ -298,96 +353,38 @@ class LeadableApp:
 
         def save_timing():
             sync.frequency_minutes = self.frequency_options[freq_dropdown.get()]
-            self.update_sync_list()
+            self.engine.reschedule(sync)
+            self.post("sync", sync)
             timing_window.destroy()
 
         ctk.CTkButton(timing_window, text="Save", command=save_timing, fg_color="#0013FF", hover_color="#0033FF", corner_radius=8, text_color="#FFFFFF", font=("Inter", 14, "bold"), height=40).pack(pady=20)
 
     def start_sync(self, sync):
         if not sync.running:
-            sync.running = True
-            sync.thread = threading.Thread(target=self.sync_loop, args=(sync,), daemon=True)
-            sync.thread.start()
-            self.update_sync_list()
+            self.engine.submit(sync)
+            self.post("sync", sync)
 
     def stop_sync(self, sync):
         if sync.running:
-            sync.running = False
-            if sync.thread:
-                sync.thread.join(timeout=1)
-            self.update_sync_list()
+            self.engine.cancel(sync)
+            self.post("sync", sync)
+
+    def backfill_sync(self, sync):
+        # Runs on the engine; progress and errors arrive through update_status
+        self.engine.start_backfill(sync)
 
     def delete_sync(self, sync, window):
         if sync in self.syncs:
             self.stop_sync(sync)
             self.syncs.remove(sync)
-            self.update_sync_list()
+            self.post("sync", sync)
             if window:
                 window.destroy()
 
-    def setup_google_sheets(self, sync):
-        creds = Credentials(token=sync.google_token)
-        client = gspread.authorize(creds)
-        return client.open_by_key(sync.sheet_id).sheet1
-
-    def get_facebook_leads(self, sync):
-        url = f"https://graph.facebook.com/v20.0/{sync.form_id}/leads"
-        params = {"access_token": sync.fb_access_token, "fields": "created_time,field_data"}
-        response = requests.get(url, params=params).json()
-        
-        if "data" not in response:
-            self.update_status(f"Error with Facebook API: {response.get('error', 'Unknown error')}")
-            return []
-        return response["data"]
-
-    def process_lead_data(self, leads):
-        processed_leads = []
-        for lead in leads:
-            lead_dict = {"date": lead["created_time"], "name": "", "email": "", "other_fields": []}
-            for field in lead["field_data"]:
-                if field["name"] == "full_name":
-                    lead_dict["name"] = field["values"][0]
-                elif field["name"] == "email":
-                    lead_dict["email"] = field["values"][0]
-                else:
-                    lead_dict["other_fields"].append(f"{field['name']}: {field['values'][0]}")
-            processed_leads.append(lead_dict)
-        return processed_leads
-
-    def update_google_sheets(self, sheet, leads):
-        headers = ["Date", "Name", "Email", "Other Fields"]
-        if not sheet.row_values(1):
-            sheet.append_row(headers)
-        
-        existing_dates = sheet.col_values(1)[1:]
-        for lead in leads:
-            if lead["date"] not in existing_dates:
-                row = [lead["date"], lead["name"], lead["email"], "; ".join(lead["other_fields"])]
-                sheet.append_row(row)
-                self.update_status(f"New lead: {lead['name']}")
-
-    def sync_loop(self, sync):
-        try:
-            sheet = self.setup_google_sheets(sync)
-            while sync.running:
-                try:
-                    self.update_status(f"Checking ({sync.name}): {datetime.now().strftime('%H:%M:%S')}")
-                    leads = self.get_facebook_leads(sync)
-                    processed_leads = self.process_lead_data(leads)
-                    self.update_google_sheets(sheet, processed_leads)
-                    self.update_status(f"Waiting ({sync.name})...")
-                    time.sleep(sync.frequency_minutes * 60)
-                except Exception as e:
-                    self.update_status(f"Error ({sync.name}): {str(e)}")
-                    time.sleep(300)
-        except Exception as e:
-            self.update_status(f"Google Sheets error ({sync.name}): {str(e)}")
-            self.stop_sync(sync)
-
     def update_status(self, message):
         self.status_label.configure(text=message)
 
-if __name__ == "__main__":
+def main():
     root = ctk.CTk()
     app = LeadableApp(root)
     root.mainloop()
@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets in seconds, from a single fast call up to a large backlog
+SECONDS_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float("inf"))
+
+METRIC_HELP = {
+    "leadeable_stage_seconds": ("histogram", "Time spent in each stage of a sync cycle"),
+    "leadeable_cycle_seconds": ("histogram", "Duration of whole sync cycles"),
+    "leadeable_cycles_total": ("counter", "Sync cycles run, by result"),
+    "leadeable_graph_pages_total": ("counter", "Graph lead pages fetched"),
+    "leadeable_leads_fetched_total": ("counter", "Leads fetched from Graph"),
+    "leadeable_rows_written_total": ("counter", "Rows appended to sheets"),
+    "leadeable_rate_limit_events_total": ("counter", "Calls throttled, cycles deferred and limits hit"),
+}
+
+class CycleStats:
+    """Stage timings and counts of one sync cycle"""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.seconds = {}
+        self.counts = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.seconds[name] = self.seconds.get(name, 0) + seconds
+
+    def count(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(SECONDS_BUCKETS)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(SECONDS_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+        self.sum += value
+        self.count += 1
+
+def format_labels(labels):
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+class Metrics:
+    """Per-sync histograms and counters, rendered in the Prometheus text format"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (name, labels tuple) -> Histogram
+        self.counters = {}  # (name, labels tuple) -> value
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            self.histograms.setdefault((name, tuple(labels.items())), Histogram()).observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        with self.lock:
+            key = (name, tuple(labels.items()))
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def record_cycle(self, sync_name, stats, result):
+        for stage, seconds in stats.seconds.items():
+            self.observe("leadeable_stage_seconds", seconds, sync=sync_name, stage=stage)
+        self.observe("leadeable_cycle_seconds", stats.elapsed(), sync=sync_name)
+        self.increment("leadeable_cycles_total", sync=sync_name, result=result)
+        for name, amount in stats.counts.items():
+            self.increment(f"leadeable_{name}_total", amount, sync=sync_name)
+
+    def render(self, extra_counters=()):
+        """Prometheus exposition text; extra_counters are (name, labels dict, value) read at scrape time"""
+        samples = {}
+        with self.lock:
+            for (name, labels), histogram in self.histograms.items():
+                lines = samples.setdefault(name, [])
+                for bound, count in zip(SECONDS_BUCKETS, histogram.buckets):
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{format_labels(dict(labels, le=le))} {count}")
+                lines.append(f"{name}_sum{format_labels(dict(labels))} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(dict(labels))} {histogram.count}")
+            for (name, labels), value in self.counters.items():
+                samples.setdefault(name, []).append(f"{name}{format_labels(dict(labels))} {value}")
+        for name, labels, value in extra_counters:
+            samples.setdefault(name, []).append(f"{name}{format_labels(labels)} {value}")
+
+        output = []
+        for name, lines in samples.items():
+            kind, description = METRIC_HELP.get(name, ("untyped", name))
+            output.append(f"# HELP {name} {description}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(lines)
+        return "\n".join(output) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] == "/metrics":
+            body = self.server.context["engine"].metrics_text().encode()
+            self.send_response(200)
+            self.send_header("Content-type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        # Scrapes arrive every few seconds; keep them out of the default log
+        logger.debug(format, *args)
+
+def start_metrics_server(engine, port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.context = {"engine": engine}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
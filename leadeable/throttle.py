@@ -0,0 +1,135 @@
+import json
+import threading
+import time
+
+from requests.structures import CaseInsensitiveDict
+
+# Graph reports usage as percentages of the app / business use case quota
+GRAPH_CALLS_PER_SECOND = 2.0  # Base call rate per access token, scaled down as reported usage grows
+GRAPH_BURST = 50
+GRAPH_USAGE_DEFER_PERCENT = 85  # Defer a token's syncs once any usage figure reaches this
+GRAPH_USAGE_COOLDOWN_SECONDS = 300  # How long to defer when Graph gives no time to regain access
+GRAPH_RATE_LIMIT_CODES = {4, 17, 32, 613}  # Plus the 80000-80099 business use case codes
+
+# Sheets allows 60 write requests per minute per user
+SHEETS_REQUESTS_PER_SECOND = 1.0
+SHEETS_BURST = 10
+SHEETS_RETRY_AFTER_SECONDS = 60  # Used when a 429 comes without a Retry-After header
+
+MIN_RATE_FRACTION = 0.1  # Slowest a bucket is throttled to, as a share of its base rate
+RATE_RECOVERY_FRACTION = 0.1  # Share of the base rate won back on each successful Sheets call
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, cost, now):
+        """Take cost tokens and return how many seconds the caller has to wait for them"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= cost
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+def graph_usage(headers):
+    """Return (highest usage percent, seconds until access is regained) from Graph usage headers
+
+    Returns None when the response carries neither header, as batch items usually don't.
+    """
+    if not headers.get("X-App-Usage") and not headers.get("X-Business-Use-Case-Usage"):
+        return None
+    percent, regain = 0, 0
+    try:
+        app_usage = json.loads(headers.get("X-App-Usage") or "{}")
+        percent = max([percent] + list(app_usage.values()))
+        business_usage = json.loads(headers.get("X-Business-Use-Case-Usage") or "{}")
+        for entries in business_usage.values():
+            for entry in entries:
+                percent = max(percent, entry.get("call_count", 0), entry.get("total_cputime", 0), entry.get("total_time", 0))
+                regain = max(regain, entry.get("estimated_time_to_regain_access", 0) * 60)
+    except (ValueError, TypeError, AttributeError):
+        pass
+    return percent, regain
+
+class RateLimiter:
+    """Token buckets per Graph access token and per spreadsheet, adapted to the APIs' rate-limit signals
+
+    Keys are ("graph", access token) and ("sheets", spreadsheet id). Callers reserve calls on a
+    bucket before making them and defer whole cycles while a key is blocked.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.blocked_until = {}
+        self.counters = {"throttled": 0, "deferred": 0, "rate_limited": 0}
+
+    def bucket(self, key):
+        if key not in self.buckets:
+            if key[0] == "graph":
+                self.buckets[key] = TokenBucket(GRAPH_CALLS_PER_SECOND, GRAPH_BURST)
+            else:
+                self.buckets[key] = TokenBucket(SHEETS_REQUESTS_PER_SECOND, SHEETS_BURST)
+        return self.buckets[key]
+
+    def reserve(self, key, cost=1):
+        """Reserve cost calls on key's bucket and return the seconds to wait before making them"""
+        with self.lock:
+            delay = self.bucket(key).reserve(cost, time.monotonic())
+            if delay > 0:
+                self.counters["throttled"] += 1
+        return delay
+
+    def defer_delay(self, keys):
+        """Return the seconds until none of keys is blocked, counting a deferral if there are any"""
+        now = time.monotonic()
+        with self.lock:
+            delay = max([self.blocked_until.get(key, 0) - now for key in keys] + [0])
+            if delay > 0:
+                self.counters["deferred"] += 1
+        return delay
+
+    def block(self, key, seconds):
+        self.blocked_until[key] = max(self.blocked_until.get(key, 0), time.monotonic() + seconds)
+
+    def observe_graph(self, token, headers):
+        """Slow a token's bucket in step with its reported usage, and block it close to the limit"""
+        usage = graph_usage(CaseInsensitiveDict(headers))
+        if usage is None:
+            return
+        percent, regain = usage
+        key = ("graph", token)
+        with self.lock:
+            bucket = self.bucket(key)
+            bucket.rate = bucket.base_rate * max(MIN_RATE_FRACTION, 1 - percent / 100)
+            if regain or percent >= GRAPH_USAGE_DEFER_PERCENT:
+                self.block(key, max(regain, GRAPH_USAGE_COOLDOWN_SECONDS))
+
+    def observe_graph_error(self, token, error):
+        code = error.get("code") if isinstance(error, dict) else None
+        if code in GRAPH_RATE_LIMIT_CODES or (isinstance(code, int) and 80000 <= code < 80100):
+            with self.lock:
+                self.counters["rate_limited"] += 1
+                self.block(("graph", token), GRAPH_USAGE_COOLDOWN_SECONDS)
+
+    def observe_sheets(self, spreadsheet_id, response):
+        """Halve a spreadsheet's rate on a 429 and win it back gradually on success"""
+        key = ("sheets", spreadsheet_id)
+        with self.lock:
+            bucket = self.bucket(key)
+            if response.status_code == 429:
+                self.counters["rate_limited"] += 1
+                bucket.rate = max(bucket.base_rate * MIN_RATE_FRACTION, bucket.rate / 2)
+                try:
+                    retry_after = float(response.headers.get("Retry-After", SHEETS_RETRY_AFTER_SECONDS))
+                except ValueError:
+                    retry_after = SHEETS_RETRY_AFTER_SECONDS
+                self.block(key, retry_after)
+            elif response.ok:
+                bucket.rate = min(bucket.base_rate, bucket.rate + bucket.base_rate * RATE_RECOVERY_FRACTION)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
@@ -0,0 +1,461 @@
+import asyncio
+import hashlib
+import hmac
+import http.client
+import json
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pytest
+import requests
+
+from leadeable import engine as engine_module, throttle
+from leadeable.engine import SHEET_HEADERS, ColumnMapping, LeadLedger, LeadStream, SheetsClient, SheetsWorksheet, SheetsWriter, SyncConfig, SyncEngine
+
+class FakeSheet:
+    title = "Sheet1"
+
+    def __init__(self, rows=()):
+        self.rows = [list(row) for row in rows]
+        self.column_reads = 0
+
+    def row_values(self, row):
+        return list(self.rows[row - 1]) if len(self.rows) >= row else []
+
+    def col_values(self, col):
+        self.column_reads += 1
+        return [row[col - 1] if len(row) >= col else "" for row in self.rows]
+
+    def update_row(self, row, values):
+        while len(self.rows) < row:
+            self.rows.append([])
+        self.rows[row - 1] = list(values)
+
+    def append_rows(self, rows):
+        self.rows.extend(list(row) for row in rows)
+
+    def queue_append(self, rows):
+        self.append_rows(rows)
+        future = Future()
+        future.set_result(None)
+        return future
+
+def lead(lead_id, created_time="2024-05-01T12:00:00+0000", **answers):
+    answers = answers or {"full_name": f"Lead {lead_id}"}
+    return {"id": str(lead_id), "created_time": created_time,
+            "field_data": [{"name": name, "values": [value]} for name, value in answers.items()]}
+
+@pytest.fixture
+def engine():
+    engine = SyncEngine(on_status=lambda message: None, ledger=LeadLedger(":memory:"))
+    yield engine
+    engine.shutdown()
+
+def open_sync(engine, sheet, name="Sync"):
+    sync = SyncConfig(name, "token", "act", "form", "sheet", 60, "google")
+    engine.prepare_sheet(sheet, sync)
+    return sync
+
+def on_loop(engine, func, *args):
+    async def call():
+        return func(*args)
+    return asyncio.run_coroutine_threadsafe(call(), engine.loop).result()
+
+def write(engine, sheet, sync, leads):
+    return asyncio.run_coroutine_threadsafe(engine.write_leads(sheet, sync, leads), engine.loop).result()
+
+def test_leads_sharing_a_second_are_all_appended(engine):
+    sheet = FakeSheet()
+    sync = open_sync(engine, sheet)
+    write(engine, sheet, sync, [lead(1), lead(2), lead(3)])
+    assert sheet.rows[0] == SHEET_HEADERS
+    assert [row[1] for row in sheet.rows[1:]] == ["Lead 1", "Lead 2", "Lead 3"]
+
+def test_first_run_skips_dates_already_in_the_sheet(engine):
+    sheet = FakeSheet([SHEET_HEADERS, ["2024-05-01T12:00:00+0000", "Old"]])
+    sync = open_sync(engine, sheet)
+    write(engine, sheet, sync, [lead(1), lead(2, "2024-05-01T12:00:01+0000")])
+    write(engine, sheet, sync, [lead(2, "2024-05-01T12:00:01+0000"), lead(3, "2024-05-01T12:00:02+0000")])
+    assert [row[0] for row in sheet.rows[1:]] == ["2024-05-01T12:00:00+0000", "2024-05-01T12:00:01+0000",
+                                                   "2024-05-01T12:00:02+0000"]
+    assert sheet.column_reads == 1
+
+def test_restart_with_a_watermark_writes_only_unseen_leads(engine):
+    sheet = FakeSheet([SHEET_HEADERS])
+    sync = open_sync(engine, sheet)
+    write(engine, sheet, sync, [lead(1)])
+    engine.ledger.set_watermark(sync.form_id, sync.sheet_id, 1714564800)
+
+    sync = open_sync(engine, sheet)
+    assert sync.last_synced_time == 1714564800 and sync.sheet_index is None
+    write(engine, sheet, sync, [lead(1), lead(2)])
+    assert [row[1] for row in sheet.rows[1:]] == ["Lead 1", "Lead 2"]
+    assert sheet.column_reads == 1
+
+def test_failed_cycles_back_off_exponentially_up_to_the_cap(engine):
+    sync = SyncConfig("Sync", "token", "act", "form", "sheet", 60, "google")
+    sync.last_started = 0
+    for failures, delay in [(1, 30), (2, 60), (3, 120), (20, 3600)]:
+        sync.failures = failures
+        assert abs(engine.next_due(sync) - delay) <= min(delay * 0.1, 120)
+
+def test_next_due_jitter_is_centred_on_the_interval(engine):
+    sync = SyncConfig("Sync", "token", "act", "form", "sheet", 60, "google")
+    sync.last_started = 0
+    dues = [engine.next_due(sync) for _ in range(500)]
+    assert 3600 - 120 <= min(dues) < 3600 < max(dues) <= 3600 + 120
+
+def test_syncs_started_together_get_spread_first_deadlines(engine):
+    dues = []
+    engine.schedule = lambda sync, due: dues.append(due - engine.loop.time())
+    for i in range(50):
+        on_loop(engine, engine.activate, SyncConfig(f"Sync {i}", "token", "act", "form", "sheet", 5, "google"))
+    assert 0 <= min(dues) < 60 and 240 < max(dues) <= 300
+
+def test_frequency_change_requeues_a_waiting_sync(engine):
+    sync = SyncConfig("Sync", "token", "act", "form", "sheet", 60, "google")
+    sync.running = True
+    sync.last_started = on_loop(engine, engine.loop.time)
+    on_loop(engine, engine.schedule, sync, engine.next_due(sync))
+    sync.frequency_minutes = 30
+    on_loop(engine, engine.apply_frequency, sync)
+    live = [entry for entry in engine.queue if entry[2] == sync.generation]
+    assert len(live) == 1 and abs(live[0][0] - sync.last_started - 1800) <= 120
+
+    # A running cycle picks the new frequency up itself when it finishes
+    sync.task, generation = object(), sync.generation
+    on_loop(engine, engine.apply_frequency, sync)
+    assert sync.generation == generation
+
+def test_fetch_batch_routes_pages_and_errors_to_their_syncs(engine, monkeypatch):
+    monkeypatch.setattr(throttle, "GRAPH_BURST", 100)  # 63 calls in one go would otherwise wait out the rate limit
+    calls = []
+
+    def post_graph_batch(token, queries):
+        calls.append(queries)
+        responses = []
+        for query in queries:
+            form_id = query.split("/")[0]
+            if form_id == "broken":
+                responses.append({"code": 400, "body": json.dumps({"error": {"message": "Unsupported get request"}})})
+            elif form_id == "paged" and "after=next" not in query:
+                page = {"data": [lead("p1")], "paging": {"next": "https://graph.facebook.com/v20.0/paged/leads?after=next"}}
+                responses.append({"code": 200, "body": json.dumps(page)})
+            else:
+                responses.append({"code": 200, "body": json.dumps({"data": [lead(form_id)]})})
+        return responses
+
+    async def drain(stream):
+        leads = []
+        while True:
+            kind, value = await stream.pages.get()
+            if kind != "page":
+                return value if kind == "error" else leads
+            leads.extend(value)
+
+    async def fetch(syncs):
+        entries = [(sync, LeadStream()) for sync in syncs]
+        drains = [asyncio.ensure_future(drain(stream)) for sync, stream in entries]
+        await engine.fetch_batch("token", entries)
+        return await asyncio.gather(*drains)
+
+    engine.post_graph_batch = post_graph_batch
+    forms = [f"form-{i}" for i in range(60)] + ["broken", "paged"]
+    syncs = [SyncConfig(form_id, "token", "act", form_id, "sheet", 60, "google") for form_id in forms]
+    results = dict(zip(forms, asyncio.run_coroutine_threadsafe(fetch(syncs), engine.loop).result()))
+
+    assert [len(queries) for queries in calls] == [50, 12, 1]
+    assert calls[2] == ["paged/leads?after=next"]
+    assert [found["id"] for found in results["paged"]] == ["p1", "paged"]
+    assert isinstance(results["broken"], RuntimeError)
+    assert all([found["id"] for found in results[form_id]] == [form_id] for form_id in forms[:60])
+
+def test_webhook_answers_the_challenge_and_writes_signed_notifications(engine, monkeypatch):
+    monkeypatch.setattr(engine_module, "WEBHOOK_BATCH_WINDOW_SECONDS", 0)
+    sheet = FakeSheet([SHEET_HEADERS])
+    sync = open_sync(engine, sheet)
+    sync.running, sync.sheet = True, sheet
+    on_loop(engine, engine.active_syncs.add, sync)
+    engine.get_leads_by_id = lambda token, form_id, lead_ids: [lead(lead_id) for lead_id in lead_ids]
+    server = engine.start_webhook(port=0, verify_token="verify", app_secret="secret", host="127.0.0.1")
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    challenge = requests.get(url, params={"hub.mode": "subscribe", "hub.verify_token": "verify", "hub.challenge": "42"})
+    assert (challenge.status_code, challenge.text) == (200, "42")
+    assert requests.get(url, params={"hub.mode": "subscribe", "hub.verify_token": "wrong"}).status_code == 403
+
+    body = json.dumps({"object": "page", "entry": [{"changes": [
+        {"field": "leadgen", "value": {"form_id": "form", "leadgen_id": lead_id}} for lead_id in ("1", "2")]}]}).encode()
+    signature = "sha256=" + hmac.new(b"secret", body, hashlib.sha256).hexdigest()
+    assert requests.post(url, data=body, headers={"X-Hub-Signature-256": "sha256=forged"}).status_code == 403
+    assert requests.post(url, data=body, headers={"X-Hub-Signature-256": signature}).status_code == 200
+    not_an_object = "sha256=" + hmac.new(b"secret", b"[1]", hashlib.sha256).hexdigest()
+    assert requests.post(url, data=b"[1]", headers={"X-Hub-Signature-256": not_an_object}).status_code == 400
+    deadline = time.monotonic() + 5
+    while len(sheet.rows) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [row[1] for row in sheet.rows[1:]] == ["Lead 1", "Lead 2"]
+
+def test_webhook_rejects_a_malformed_content_length(engine):
+    server = engine.start_webhook(port=0, host="127.0.0.1")
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+    connection.putrequest("POST", "/")
+    connection.putheader("Content-Length", "abc")
+    connection.endheaders()
+    assert connection.getresponse().status == 400
+
+def test_notified_leads_skip_syncs_stopped_meanwhile(engine):
+    sheet = FakeSheet([SHEET_HEADERS])
+    sync = open_sync(engine, sheet)
+    sync.running, sync.sheet = False, sheet
+    engine.get_leads_by_id = lambda token, form_id, lead_ids: [lead(lead_id) for lead_id in lead_ids]
+    asyncio.run_coroutine_threadsafe(engine.sync_notified_leads("token", [sync], ["1"]), engine.loop).result()
+    assert sheet.rows == [SHEET_HEADERS]
+
+def test_syncs_sharing_a_tab_share_its_header_row(engine):
+    sheet = FakeSheet([SHEET_HEADERS])
+    first, second = open_sync(engine, sheet, "First"), open_sync(engine, sheet, "Second")
+    write(engine, sheet, first, [lead(1, full_name="A", budget="100")])
+    write(engine, sheet, second, [lead(2, full_name="B", city="Paris")])
+    assert sheet.rows[0] == SHEET_HEADERS + ["budget", "city"]
+    assert sheet.rows[1][1:] == ["A", "", "100"]
+    assert sheet.rows[2][1:] == ["B", "", "", "Paris"]
+
+def test_column_mapping_gives_new_questions_their_own_column():
+    columns = ColumnMapping(["Date", "Name"])
+    assert columns.headers == ["Date", "Name", "Email"]
+    assert columns.add_fields([lead(1, email="a@b.c", budget="5")])
+    assert not columns.add_fields([lead(2, budget="7")])
+    assert columns.row(lead(3, budget="9")) == ["2024-05-01T12:00:00+0000", "", "", "9"]
+
+def test_column_mapping_keeps_the_columns_of_an_existing_header_row():
+    columns = ColumnMapping(["Name", "budget", "Date", "Email"])
+    assert columns.headers == ["Name", "budget", "Date", "Email"]
+    assert not columns.add_fields([lead(1, full_name="Ann", budget="5")])
+    assert columns.row(lead(1, full_name="Ann", budget="5")) == ["Ann", "5", "2024-05-01T12:00:00+0000", ""]
+    assert columns.add_fields([lead(2, city="Oslo")])
+    assert columns.headers == ["Name", "budget", "Date", "Email", "city"]
+
+def test_notified_leads_of_another_form_are_dropped(engine):
+    class Response:
+        headers = {}
+
+        def json(self):
+            return {"1": dict(lead(1), form_id="other"), "2": dict(lead(2), form_id="form")}
+
+    engine.session.get = lambda *args, **kwargs: Response()
+    assert [found["id"] for found in engine.get_leads_by_id("token", "form", ["1", "2"])] == ["2"]
+
+def test_webhook_needs_an_app_secret_off_loopback(engine):
+    with pytest.raises(ValueError):
+        engine.start_webhook(port=0, host="0.0.0.0", app_secret="")
+
+def test_ledger_returns_claimed_leads_until_they_are_written():
+    ledger = LeadLedger(":memory:")
+    assert ledger.claim("form", "sheet", ["1", "2"]) == {"1", "2"}
+    ledger.mark_written("form", "sheet", ["1"])
+    assert ledger.claim("form", "sheet", ["1", "2", "3"]) == {"2", "3"}
+    assert ledger.claim("form", "other-sheet", ["1"]) == {"1"}
+
+def test_ledger_keeps_watermark_and_backfill_across_restarts(tmp_path):
+    path = str(tmp_path / "ledger.db")
+    ledger = LeadLedger(path)
+    ledger.set_watermark("form", "sheet", 100)
+    ledger.set_watermark("form", "sheet", 200)
+    ledger.save_backfill("form", "sheet", 10, 50, 30)
+    ledger.mark_written("form", "sheet", ledger.claim("form", "sheet", ["1"]))
+    ledger.conn.close()
+
+    ledger = LeadLedger(path)
+    assert ledger.get_watermark("form", "sheet") == 200
+    assert ledger.get_watermark("form", "other-sheet") is None
+    assert ledger.get_backfill("form", "sheet") == (10, 50, 30)
+    assert ledger.claim("form", "sheet", ["1"]) == set()
+
+def test_next_page_query_drops_the_version_prefix(engine):
+    assert engine.next_page_query({"paging": {"next": "https://graph.facebook.com/v20.0/form/leads?after=abc&limit=100"}}) == "form/leads?after=abc&limit=100"
+    assert engine.next_page_query({"data": [], "paging": {}}) is None
+
+def test_interrupted_backfill_resumes_after_its_last_written_window(engine):
+    sheet = FakeSheet([SHEET_HEADERS])
+    sync = SyncConfig("Sync", "token", "act", "form", "sheet", 60, "google")
+    engine.setup_google_sheets = lambda sync: sheet
+    since = int(time.time()) - 4 * 7 * 86400 + 60
+    fetched, failing = [], [since + 2 * 7 * 86400]
+
+    async def fetch_window(sync, start, end):
+        fetched.append(start)
+        if start in failing:
+            failing.remove(start)
+            raise RuntimeError("Graph down")
+        return [lead(start, datetime.fromtimestamp(start, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+0000"))]
+
+    engine.fetch_window = fetch_window
+    with pytest.raises(RuntimeError):
+        asyncio.run_coroutine_threadsafe(engine.backfill(sync, since), engine.loop).result()
+    assert engine.ledger.get_backfill(sync.form_id, sync.sheet_id)[2] == since + 2 * 7 * 86400
+
+    fetched.clear()
+    assert asyncio.run_coroutine_threadsafe(engine.backfill(sync, since), engine.loop).result() == 2
+    assert fetched == [since + 2 * 7 * 86400, since + 3 * 7 * 86400]
+    assert [row[1] for row in sheet.rows[1:]] == [f"Lead {since + week * 7 * 86400}" for week in range(4)]
+    assert sync.last_synced_time == engine.ledger.get_backfill(sync.form_id, sync.sheet_id)[1]
+
+def test_backfill_counts_appended_rows_and_keeps_its_sheet(engine):
+    sheet = FakeSheet([SHEET_HEADERS])
+    sync = SyncConfig("Sync", "token", "act", "form", "sheet", 60, "google")
+    engine.setup_google_sheets = lambda sync: sheet
+    engine.prepare_sheet(sheet, sync)
+    engine.ledger.claim(sync.form_id, sync.target_id, ["1"])
+    engine.ledger.mark_written(sync.form_id, sync.target_id, ["1"])
+
+    async def fetch_window(sync, start, end):
+        sync.sheet = None  # As if the sync were started while the backfill runs
+        return [lead(1), lead(2)] if start == since else []
+
+    engine.fetch_window = fetch_window
+    since = int(time.time()) - 3 * 86400
+    written = asyncio.run_coroutine_threadsafe(engine.backfill(sync, since), engine.loop).result()
+    assert written == 1
+    assert len(sheet.rows) == 2
+
+def test_new_sync_starts_without_a_watermark():
+    sync = SyncConfig("Sync", "token", "act", "form", "sheet", 60, "google")
+    assert sync.last_synced_time is None and sync.sheet_index is None
+
+def test_tabs_opened_together_share_one_metadata_lookup():
+    calls = []
+
+    class Session:
+        def request(self, method, url, **kwargs):
+            calls.append(url)
+            time.sleep(0.05)
+            response = requests.Response()
+            response.status_code = 200
+            response._content = b'{"sheets": [{"properties": {"sheetId": 0, "title": "A"}}, {"properties": {"sheetId": 1, "title": "B"}}]}'
+            return response
+
+    client = SheetsClient(Session(), "google")
+    with ThreadPoolExecutor(2) as pool:
+        tabs = list(pool.map(lambda title: SheetsWorksheet(client, "sheet", title), ["A", "B"]))
+    assert [tab.worksheet_id for tab in tabs] == [0, 1]
+    assert len(calls) == 1
+
+def test_worksheet_added_later_is_found_after_one_more_lookup():
+    tabs = ["A"]
+
+    class Session:
+        def request(self, method, url, **kwargs):
+            response = requests.Response()
+            response.status_code = 200
+            response._content = json.dumps({"sheets": [{"properties": {"sheetId": i, "title": title}} for i, title in enumerate(tabs)]}).encode()
+            return response
+
+    client = SheetsClient(Session(), "google")
+    assert SheetsWorksheet(client, "sheet", "A").worksheet_id == 0
+    tabs.append("B")
+    assert SheetsWorksheet(client, "sheet", "B").worksheet_id == 1
+    with pytest.raises(ValueError):
+        SheetsWorksheet(client, "sheet", "C")
+
+def test_writer_sends_appends_to_one_spreadsheet_as_one_batch_update():
+    posts = []
+
+    class Session:
+        def request(self, method, url, **kwargs):
+            if method == "POST":
+                posts.append(kwargs["json"]["requests"])
+            response = requests.Response()
+            response.status_code = 200
+            response._content = b'{"sheets": [{"properties": {"sheetId": 0, "title": "A"}}, {"properties": {"sheetId": 1, "title": "B"}}]}'
+            return response
+
+    writer = SheetsWriter(Session(), window=0.05)
+    futures = [writer.worksheet("google", "sheet", title).queue_append([[title, "x"]]) for title in ["A", "B"]]
+    for future in futures:
+        future.result(timeout=5)
+    assert [[request["appendCells"]["sheetId"] for request in requests] for requests in posts] == [[0, 1]]
+
+    writer.close()
+    with pytest.raises(RuntimeError):
+        writer.worksheet("google", "sheet", "A").queue_append([["late"]])
+
+def test_writer_flushes_a_full_batch_at_once_and_reserves_one_call_per_request():
+    posts = []
+
+    class Session:
+        def request(self, method, url, **kwargs):
+            if method == "POST":
+                posts.append(kwargs["json"]["requests"])
+            response = requests.Response()
+            response.status_code = 200
+            response._content = b'{"sheets": [{"properties": {"sheetId": 0, "title": "A"}}]}'
+            return response
+
+    limiter = throttle.RateLimiter()
+    writer = SheetsWriter(Session(), limiter, window=60)
+    sheet = writer.worksheet("google", "sheet")
+    futures = [sheet.queue_append([["x"]] * rows) for rows in (3000, 2000)]
+    for future in futures:
+        future.result(timeout=5)
+    assert [len(requests) for requests in posts] == [2]
+    assert limiter.bucket(("sheets", "sheet")).tokens == pytest.approx(throttle.SHEETS_BURST - 1, abs=0.1)
+    writer.close()
+
+def test_write_leads_queues_every_chunk_before_waiting(engine):
+    queued = []
+
+    class QueuedSheet(FakeSheet):
+        def queue_append(self, rows):
+            queued.append(Future())
+            return queued[-1]
+
+    sheet = QueuedSheet([SHEET_HEADERS])
+    sync = open_sync(engine, sheet)
+    result = asyncio.run_coroutine_threadsafe(engine.write_leads(sheet, sync, [lead(1), lead(2), lead(3)], 1), engine.loop)
+    deadline = time.monotonic() + 5
+    while len(queued) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(queued) == 3
+    for future in queued:
+        future.set_result(None)
+    assert result.result(timeout=5) == 3
+    assert engine.ledger.claim(sync.form_id, sync.target_id, ["1", "2", "3"]) == set()
+
+def test_load_config_coerces_and_checks_frequency(tmp_path):
+    from leadeable.__main__ import load_config
+    sync = {"fb_access_token": "token", "ad_account_id": "act", "form_id": 1, "sheet_id": "sheet", "google_token": "google"}
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"syncs": [dict(sync, frequency_minutes="60")]}))
+    assert load_config(str(path))[1][0].frequency_minutes == 60
+    path.write_text(json.dumps({"syncs": [dict(sync, frequency_minutes="hourly")]}))
+    with pytest.raises(SystemExit, match="Sync 1"):
+        load_config(str(path))
+
+def test_streamed_pages_are_written_oldest_first(engine):
+    sheet = FakeSheet([SHEET_HEADERS])
+    sync = open_sync(engine, sheet)
+    sync.sheet = sheet
+
+    async def pages(sync):
+        yield [lead(3, "2024-05-03T12:00:00+0000"), lead(2, "2024-05-02T12:00:00+0000")]
+        yield [lead(1, "2024-05-01T12:00:00+0000")]
+
+    engine.get_facebook_leads = pages
+    asyncio.run_coroutine_threadsafe(engine.stream_leads(sync), engine.loop).result()
+    assert [row[1] for row in sheet.rows[1:]] == ["Lead 1", "Lead 2", "Lead 3"]
+
+def test_poll_starts_after_an_unfinished_backfill(engine):
+    sheet = FakeSheet([SHEET_HEADERS])
+    sync = SyncConfig("Sync", "token", "act", "form", "sheet", 60, "google")
+    engine.setup_google_sheets = lambda sync: sheet
+    engine.ledger.save_backfill(sync.form_id, sync.target_id, 100, 500, 200)
+    polled_from = []
+
+    async def pages(sync):
+        polled_from.append(sync.last_synced_time)
+        yield []
+
+    engine.get_facebook_leads = pages
+    asyncio.run_coroutine_threadsafe(engine.run_sync_cycle(sync), engine.loop).result()
+    assert polled_from == [500]
@@ -0,0 +1,36 @@
+import requests
+
+from leadeable.metrics import CycleStats, Metrics, start_metrics_server
+
+def test_render_writes_prometheus_histograms_and_counters():
+    metrics = Metrics()
+    stats = CycleStats()
+    stats.add("sheet_write", 0.2)
+    stats.count("rows_written", 3)
+    metrics.record_cycle('Sync "A"', stats, "ok")
+    lines = metrics.render([("leadeable_rate_limit_events_total", {"kind": "deferred"}, 2)]).splitlines()
+
+    assert "# HELP leadeable_stage_seconds Time spent in each stage of a sync cycle" in lines
+    assert "# TYPE leadeable_stage_seconds histogram" in lines
+    assert 'leadeable_stage_seconds_bucket{sync="Sync \\"A\\"",stage="sheet_write",le="0.1"} 0' in lines
+    assert 'leadeable_stage_seconds_bucket{sync="Sync \\"A\\"",stage="sheet_write",le="0.25"} 1' in lines
+    assert 'leadeable_stage_seconds_bucket{sync="Sync \\"A\\"",stage="sheet_write",le="+Inf"} 1' in lines
+    assert 'leadeable_stage_seconds_count{sync="Sync \\"A\\"",stage="sheet_write"} 1' in lines
+    assert 'leadeable_cycles_total{sync="Sync \\"A\\"",result="ok"} 1' in lines
+    assert "# TYPE leadeable_rows_written_total counter" in lines
+    assert 'leadeable_rows_written_total{sync="Sync \\"A\\""} 3' in lines
+    assert 'leadeable_rate_limit_events_total{kind="deferred"} 2' in lines
+
+def test_metrics_server_serves_only_the_metrics_path():
+    class Engine:
+        def metrics_text(self):
+            return "leadeable_cycles_total 1\n"
+
+    server = start_metrics_server(Engine(), 0)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        response = requests.get(url + "/metrics")
+        assert response.status_code == 200 and response.text == "leadeable_cycles_total 1\n"
+        assert requests.get(url + "/other").status_code == 404
+    finally:
+        server.shutdown()
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from leadeable.throttle import GRAPH_USAGE_COOLDOWN_SECONDS, RateLimiter, graph_usage
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = headers or {}
+
+def test_graph_usage_takes_the_highest_figure_of_both_headers():
+    headers = {
+        "X-App-Usage": json.dumps({"call_count": 12, "total_cputime": 30, "total_time": 5}),
+        "X-Business-Use-Case-Usage": json.dumps({"act_1": [
+            {"type": "ads_management", "call_count": 40, "total_cputime": 64, "total_time": 8,
+             "estimated_time_to_regain_access": 0},
+            {"type": "lead_retrieval", "call_count": 3, "total_cputime": 1, "total_time": 2,
+             "estimated_time_to_regain_access": 7},
+        ]}),
+    }
+    assert graph_usage(headers) == (64, 420)
+
+@pytest.mark.parametrize("headers", [{"X-App-Usage": "not json"}, {"X-Business-Use-Case-Usage": "[1]"},
+                                     {"X-Business-Use-Case-Usage": json.dumps({"act_1": ["x"]})}])
+def test_graph_usage_ignores_missing_or_malformed_headers(headers):
+    assert graph_usage(headers) == (0, 0)
+
+def test_graph_responses_without_usage_headers_keep_the_rate():
+    limiter = RateLimiter()
+    limiter.observe_graph("token", {"x-app-usage": json.dumps({"call_count": 40})})
+    limiter.observe_graph("token", {"Content-Type": "application/json"})
+    bucket = limiter.bucket(("graph", "token"))
+    assert graph_usage({"Content-Type": "application/json"}) is None
+    assert bucket.rate == pytest.approx(bucket.base_rate * 0.6)
+
+def test_graph_usage_near_the_limit_defers_the_token():
+    limiter = RateLimiter()
+    limiter.observe_graph("token", {"x-app-usage": json.dumps({"call_count": 90})})
+    assert limiter.defer_delay([("graph", "token")]) > GRAPH_USAGE_COOLDOWN_SECONDS - 5
+    assert limiter.defer_delay([("graph", "other-token")]) == 0
+    assert limiter.stats()["deferred"] == 1
+
+def test_sheets_429_halves_the_rate_and_blocks_for_retry_after():
+    limiter = RateLimiter()
+    limiter.observe_sheets("sheet", Response(429, {"Retry-After": "30"}))
+    bucket = limiter.bucket(("sheets", "sheet"))
+    assert bucket.rate == bucket.base_rate / 2
+    assert 25 < limiter.defer_delay([("sheets", "sheet")]) <= 30
+    limiter.observe_sheets("sheet", Response(200))
+    assert bucket.rate == pytest.approx(bucket.base_rate * 0.6)
+    assert limiter.stats()["rate_limited"] == 1